@@ -0,0 +1,28 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Make the backend importable from benchmarks run outside of Mirage.
+
+Benchmarks are standalone scripts, run from the repository's root with
+the backend's requirements installed, e.g.
+`python benchmarks/event_compaction.py`.
+
+The `pyotherside` module only exists when Python is embedded in the
+QML application, so it is replaced by one that drops sent events.
+"""
+
+import sys
+from pathlib import Path
+from types import ModuleType
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+if "pyotherside" not in sys.modules:
+    pyotherside        = ModuleType("pyotherside")
+    pyotherside.send   = lambda *args: None  # type: ignore
+    pyotherside.atexit = lambda func: None  # type: ignore
+
+    sys.modules["pyotherside"] = pyotherside
@@ -0,0 +1,83 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Memory used by `Event` items before and after `Event.compact()`.
+
+Usage: `python benchmarks/event_compaction.py [number of events]`,
+100000 events by default. Memory is measured with tracemalloc, which
+needs about 1 GiB of RAM per 100000 events.
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import common  # noqa: F401
+import nio
+
+from backend.models.items import Event
+
+SENDERS = [f"@user{i}:example.org" for i in range(300)]
+NAMES   = {sender: f"User {i}" for i, sender in enumerate(SENDERS)}
+
+
+def make_event(i: int) -> Event:
+    sender = "".join(SENDERS[i % 300])  # new string, like parsed JSON
+    source = nio.Event.parse_event({
+        "type":             "m.room.message",
+        "event_id":         f"$ev{i}:example.org",
+        "sender":           sender,
+        "origin_server_ts": 1_600_000_000_000 + i,
+        "content":          {"msgtype": "m.text", "body": f"message {i}"},
+        "unsigned":         {"age": 1234},
+    })
+
+    event = Event(
+        id             = source.event_id,
+        event_id       = source.event_id,
+        event_type     = type(source),
+        source         = source,
+        date           = datetime.fromtimestamp(i),
+        sender_id      = source.sender,
+        sender_name    = NAMES[SENDERS[i % 300]],
+        sender_avatar  = "mxc://example.org/" + "abc"[:i % 3],
+        content        = source.body,
+        inline_content = source.body,
+    )
+    event.serialized  # Done when the item is sent to QML
+    return event
+
+
+def main(count: int) -> None:
+    tracemalloc.start()
+    gc.collect()
+    base = tracemalloc.get_traced_memory()[0]
+
+    events = [make_event(i) for i in range(count)]
+    gc.collect()
+    full = tracemalloc.get_traced_memory()[0] - base
+
+    start = time.perf_counter()
+
+    for event in events:
+        event.compact()
+
+    took = time.perf_counter() - start
+    gc.collect()
+    compacted = tracemalloc.get_traced_memory()[0] - base
+
+    print(
+        f"{count} events: {full / count:.0f} B/event before, "
+        f"{compacted / count:.0f} B/event compacted "
+        f"(-{(1 - compacted / full) * 100:.0f}%), compacting took {took:.2f}s",
+    )
+
+    source = events[5].nio_source
+    assert isinstance(source, nio.RoomMessageText), source
+    assert source.body == "message 5"
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,115 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Time taken by `MediaCache` to answer thumbnail requests for cached files.
+
+Usage: `python benchmarks/media_cache_lookups.py [scrolls]`, 50 by default.
+Each scroll requests the thumbnails of 200 images, cached at a bigger size
+than the one shown, and 100 avatars. Requests are answered once with the
+in-memory index of cached files, and once checking the filesystem for
+every path like before it existed.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import common  # noqa: F401
+
+from backend.media_cache import MediaCache, MxcEvents
+from backend.models.model_store import ModelStore
+
+IMAGES  = 200
+AVATARS = 100
+
+# (mxc, title, shown size)
+Request = Tuple[str, str, Tuple[int, int]]
+
+
+def make_cache_files(base_dir: Path) -> List[Request]:
+    requests = []
+
+    for i in range(IMAGES):
+        mxc_id = f"M{i:020d}"
+        path   = base_dir / f"thumbnails/example.org/800x600/{i}_{mxc_id}.png"
+        mxc    = f"mxc://example.org/{mxc_id}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"image")
+        requests.append((mxc, f"{i}.png", (300, 200)))
+
+    for i in range(AVATARS):
+        mxc_id = f"A{i:020d}"
+        path   = base_dir / f"thumbnails/example.org/96x96/{i}_{mxc_id}"
+        mxc    = f"mxc://example.org/{mxc_id}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"avatar")
+        requests.append((mxc, str(i), (72, 72)))
+
+    return requests
+
+
+async def measure(
+    cache: MediaCache, requests: List[Request], scrolls: int,
+) -> Tuple[float, float]:
+    """Return the microseconds and stat() calls taken per request."""
+
+    stats     = 0
+    real_stat = os.stat
+
+    def counting_stat(*args, **kwargs):
+        nonlocal stats
+        stats += 1
+        return real_stat(*args, **kwargs)
+
+    os.stat = counting_stat  # type: ignore
+    start   = time.perf_counter()
+
+    try:
+        for _ in range(scrolls):
+            for mxc, title, (width, height) in requests:
+                await cache.get_thumbnail(width, height, "@me:x", mxc, title)
+    finally:
+        os.stat = real_stat
+
+    count = scrolls * len(requests)
+    return ((time.perf_counter() - start) / count * 1e6, stats / count)
+
+
+async def main(scrolls: int) -> None:
+    MediaCache.eviction_interval = 3600
+
+    files   = SimpleNamespace(
+        max_downloads_cache_size=0, max_thumbnails_cache_size=0,
+    )
+    backend = SimpleNamespace(
+        clients                   = {},
+        mxc_events                = MxcEvents(),
+        models                    = ModelStore(),
+        notification_avatar_cache = {},
+        settings = SimpleNamespace(Chat=SimpleNamespace(Files=files)),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        requests = make_cache_files(Path(tmp))
+        cache    = MediaCache(backend, Path(tmp))  # type: ignore
+
+        while not cache._files_indexed:
+            await asyncio.sleep(0.05)
+
+        indexed = await measure(cache, requests, scrolls)
+        cache._files_indexed = False
+        unindexed = await measure(cache, requests, scrolls)
+        cache._evictor.cancel()
+
+    for name, (micros, stats) in (("filesystem", unindexed),
+                                  ("index", indexed)):
+        print(f"{name}: {micros:.1f}us and {stats:.1f} stat() per request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
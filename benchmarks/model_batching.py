@@ -0,0 +1,119 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Cost of batched model changes in a large room, and their correctness.
+
+Usage: `python benchmarks/model_batching.py [members] [updates]`, 50000
+members and 3000 updates by default. Members of a room get presence and
+status changes with `ModelItem.set_fields()`, a batch being flushed after
+every 10 changes like a busy frame would.
+
+The events sent to QML are replayed on plain lists to check that they
+reproduce the models, including a transfers model whose items have `UUID`
+IDs that differ from their `str` keys.
+"""
+
+import random
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+import common  # noqa: F401
+import pyotherside
+
+from backend.models.items import Member, Presence, Transfer
+from backend.models.model import Model
+from backend.models.model_store import ModelStore
+
+CHANGES_PER_FLUSH = 10
+
+replayed: Dict[Any, List[Dict[str, Any]]] = {}
+
+
+def replay(name: str, sync_id: Any, *args) -> None:
+    rows = replayed.setdefault(sync_id, [])
+    ops  = args[0] if name == "ModelBatchChanged" else [[
+        {"ModelItemSet": "set", "ModelItemDeleted": "delete"}.get(name, name),
+        *args,
+    ]]
+
+    for kind, *op in ops:
+        if kind in ("clear", "ModelCleared"):
+            rows.clear()
+        elif kind == "delete":
+            del rows[op[0]:op[0] + op[1]]
+        elif kind == "set" and op[0] is None:
+            rows.insert(op[1], dict(op[2]))
+        elif kind == "set":
+            rows[op[0]].update(op[2])
+            rows.insert(op[1], rows.pop(op[0]))
+
+
+def check(model: Model) -> None:
+    Model.flush_batches()
+    got      = replayed.get(model.sync_id, [])
+    expected = [item.serialized for item in model._sorted_data]
+    assert got == expected, f"{model.sync_id} differs from its QML replay"
+
+
+def main(member_count: int = 50_000, update_count: int = 3000) -> None:
+    random.seed(1)
+    pyotherside.send = replay  # type: ignore
+
+    store   = ModelStore()
+    members = store["@a:x", "!r:x", "members"]
+
+    members.reset({
+        f"@u{i}:x": Member(id=f"@u{i}:x", display_name=f"user {i}")
+        for i in range(member_count)
+    })
+
+    presences = list(Presence.State)
+    ids       = [
+        f"@u{random.randrange(member_count)}:x" for _ in range(update_count)
+    ]
+    start = time.perf_counter()
+
+    for i, user_id in enumerate(ids):
+        member = members[user_id]
+
+        if i % 2:
+            member.set_fields(status_msg=f"status {i}")
+        else:
+            member.set_fields(presence=random.choice(presences))
+
+        if i % CHANGES_PER_FLUSH == CHANGES_PER_FLUSH - 1:
+            Model.flush_batches()
+
+    elapsed = time.perf_counter() - start
+
+    for user_id in ids[:50]:
+        if user_id in members:
+            del members[user_id]
+
+    check(members)
+
+    transfers = store["transfers"]
+    items     = [Transfer(id=uuid.uuid4(), is_upload=False) for _ in range(5)]
+
+    for transfer in items:
+        transfers[str(transfer.id)] = transfer
+
+    check(transfers)
+
+    for i, transfer in enumerate(items):
+        transfer.set_fields(transferred=i * 100, paused=bool(i % 2))
+
+    del transfers[str(items[0].id)]
+    check(transfers)
+
+    print(
+        f"{member_count} members: "
+        f"{elapsed / update_count * 10 ** 6:,.1f}µs per batched change "
+        f"(flushed every {CHANGES_PER_FLUSH}), replays match",
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,78 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Speed of updates that move rooms in their sorted models.
+
+Usage: `python benchmarks/model_sorting.py [rooms] [updates]`, 10000 rooms
+and 3000 updates by default. The rooms of an account are given a new last
+event date, which moves them to the top of the account's `rooms` model
+and of the `all_rooms` proxy, first with `ModelItem.set_fields()`, then
+by replacing the items.
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import common  # noqa: F401
+
+from backend.models.items import Account, Room
+from backend.models.model_store import ModelStore
+
+BASE_DATE = datetime(2021, 1, 1)
+
+
+def date(seconds: int) -> datetime:
+    return BASE_DATE + timedelta(seconds=seconds)
+
+
+def main(room_count: int = 10_000, update_count: int = 3000) -> None:
+    random.seed(1)
+
+    store = ModelStore()
+    rooms = store["@a:x", "rooms"]
+    store["accounts"]["@a:x"] = Account("@a:x", 0)
+    store["all_rooms"]  # Proxy that must be kept sorted too
+
+    for i in range(room_count):
+        rooms[f"!r{i}:x"] = Room(
+            id              = f"!r{i}:x",
+            for_account     = "@a:x",
+            display_name    = f"room {i}",
+            last_event_date = date(random.randrange(10 ** 6)),
+        )
+
+    ids = [
+        f"!r{random.randrange(room_count)}:x" for _ in range(update_count)
+    ]
+
+    start = time.perf_counter()
+
+    for i, room_id in enumerate(ids):
+        rooms[room_id].set_fields(
+            last_event_date=date(10 ** 6 + i), unreads=i % 3,
+        )
+
+    set_fields = update_count / (time.perf_counter() - start)
+    start      = time.perf_counter()
+
+    for i, room_id in enumerate(ids):
+        rooms[room_id] = Room(
+            id              = room_id,
+            for_account     = "@a:x",
+            display_name    = rooms[room_id].display_name,
+            last_event_date = date(2 * 10 ** 6 + i),
+            unreads         = i % 2,
+        )
+
+    replace = update_count / (time.perf_counter() - start)
+
+    print(
+        f"{room_count} rooms: {set_fields:,.0f} set_fields() updates/s, "
+        f"{replace:,.0f} item replacements/s",
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
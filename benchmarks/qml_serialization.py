@@ -0,0 +1,87 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Speed of `serialize_value_for_qml()` with cached conversions.
+
+Usage: `python benchmarks/qml_serialization.py [rounds]`, 2000 by default.
+The fields of a mix of `Room` and `Event` items are serialized like models
+do, once through `QML_SERIALIZERS` and once resolving the conversion for
+every value, which is what was done before conversions were cached.
+"""
+
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, List
+
+import common  # noqa: F401
+import nio
+
+from backend.models.items import Event, Room
+from backend.utils import _find_qml_serializer, serialize_value_for_qml
+
+
+def uncached(value: Any, json_list_dicts: bool = False) -> Any:
+    return _find_qml_serializer(type(value), json_list_dicts, False)(value)
+
+
+def field_values() -> List[Any]:
+    room = Room(
+        id             = "!room:example.org",
+        for_account    = "@user:example.org",
+        display_name   = "Room",
+        typing_members = ["@other:example.org"],
+    )
+
+    events = [
+        Event(
+            id            = f"$ev{i}:example.org",
+            event_id      = f"$ev{i}:example.org",
+            event_type    = nio.RoomMessageText,
+            date          = datetime.now(),
+            sender_id     = "@user:example.org",
+            sender_name   = "User",
+            sender_avatar = "mxc://example.org/abc",
+            content       = f"message {i}",
+            links         = ["https://example.org"],
+        ) for i in range(2)
+    ]
+
+    return [
+        getattr(item, name)
+        for item in (room, *events)
+        for name in item.qml_fields()
+        if name not in ("source", "parent_model")
+    ]
+
+
+def measure(
+    serialize: Callable[..., Any], values: List[Any], rounds: int,
+) -> float:
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        for value in values:
+            serialize(value, json_list_dicts=True)
+
+    return len(values) * rounds / (time.perf_counter() - start)
+
+
+def main(rounds: int) -> None:
+    values = field_values()
+
+    for value in values:
+        cached = serialize_value_for_qml(value, json_list_dicts=True)
+        assert cached == uncached(value, json_list_dicts=True), value
+
+    before = measure(uncached, values, rounds)
+    after  = measure(serialize_value_for_qml, values, rounds)
+
+    print(
+        f"{before / 1e6:.2f}M values/s resolving conversions, "
+        f"{after / 1e6:.2f}M values/s cached (x{after / before:.1f})",
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,133 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Worst event loop stall while nio processes a large sync response.
+
+Usage: `python benchmarks/sync_cooperation.py [rooms]`, 1000 by default.
+A synthetic sync with 5 messages per room is processed by a nio client
+whose message callback does 0.4ms of work, while a probe coroutine
+sleeps 5ms in a loop to measure how late it wakes up. The sync is
+processed once without and once with a `SyncScheduler.cooperate()`
+callback, registered first like `NioCallbacks` does.
+
+With it, the worst stall should be about `SyncScheduler.time_slice`,
+unless the garbage collector happens to run a full collection during
+the sync, which adds around 100ms.
+"""
+
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import common  # noqa: F401
+import nio
+
+from backend.sync_scheduler import SyncScheduler
+
+EVENTS_PER_ROOM = 5
+CALLBACK_WORK   = 0.0004
+PROBE_INTERVAL  = 0.005
+
+
+def sync_dict(rooms: int) -> Dict[str, Any]:
+    def room(number: int) -> Dict[str, Any]:
+        member = {
+            "type":             "m.room.member",
+            "event_id":         f"$member{number}",
+            "sender":           "@user:example.org",
+            "state_key":        "@user:example.org",
+            "origin_server_ts": 0,
+            "content":          {"membership": "join"},
+        }
+        messages = [{
+            "type":             "m.room.message",
+            "event_id":         f"$message{number}_{i}",
+            "sender":           "@user:example.org",
+            "origin_server_ts": i,
+            "content":          {"msgtype": "m.text", "body": "hi"},
+        } for i in range(EVENTS_PER_ROOM)]
+
+        return {
+            "timeline": {
+                "events": messages, "limited": False, "prev_batch": "p",
+            },
+            "state":                {"events": [member]},
+            "ephemeral":            {"events": []},
+            "account_data":         {"events": []},
+            "summary":              {},
+            "unread_notifications": {},
+        }
+
+    return {
+        "next_batch": "n",
+        "rooms": {
+            "join":   {f"!r{i}:example.org": room(i) for i in range(rooms)},
+            "invite": {},
+            "leave":  {},
+        },
+        "to_device":                  {"events": []},
+        "presence":                   {"events": []},
+        "account_data":               {"events": []},
+        "device_lists":               {"changed": [], "left": []},
+        "device_one_time_keys_count": {},
+    }
+
+
+async def measure(rooms: int, cooperative: bool) -> None:
+    ui_state  = SimpleNamespace(data={"pageProperties": {}})
+    backend   = SimpleNamespace(ui_state=ui_state)
+    scheduler = SyncScheduler(backend)  # type: ignore
+    client    = nio.AsyncClient("https://example.org", "@user:example.org")
+    client.user_id = "@user:example.org"
+
+    async def cooperate(_room, _event) -> None:
+        await scheduler.cooperate()
+
+    async def work(_room, _event) -> None:
+        end = time.perf_counter() + CALLBACK_WORK
+
+        while time.perf_counter() < end:
+            pass
+
+    if cooperative:
+        client.add_event_callback(cooperate, nio.Event)
+
+    client.add_event_callback(work, nio.RoomMessageText)
+
+    response            = nio.SyncResponse.from_dict(sync_dict(rooms))
+    stalls: List[float] = []
+    done                = False
+
+    async def probe() -> None:
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(PROBE_INTERVAL)
+            stalls.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+    prober = asyncio.ensure_future(probe())
+    await asyncio.sleep(PROBE_INTERVAL * 4)
+
+    start = time.perf_counter()
+    await client.receive_response(response)
+    took  = time.perf_counter() - start
+
+    done = True
+    await prober
+    await client.close()
+    scheduler._monitor.cancel()
+
+    print(
+        f"{'With' if cooperative else 'Without'} cooperate(): "
+        f"processed in {took:.2f}s, worst stall {max(stalls) * 1000:.0f}ms",
+    )
+
+
+def main(rooms: int) -> None:
+    asyncio.run(measure(rooms, cooperative=False))
+    asyncio.run(measure(rooms, cooperative=True))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -26,14 +26,17 @@ from nio.client.async_client import client_session
 from . import __app_name__
 from .errors import MatrixError, MatrixInvalidAccessToken
 from .matrix_client import MatrixClient
-from .media_cache import MediaCache
+from .media_cache import MediaCache, MxcEvents
+from .model_cache import ModelCache
 from .models import SyncId
 from .models.filters import FieldStringFilter
-from .models.items import Account, Event, Homeserver, PingStatus
+from .models.items import Account, Homeserver, PingStatus
 from .models.model import Model
 from .models.model_store import ModelStore
 from .presence import Presence
 from .sso_server import SSOServer
+from .sync_scheduler import SyncScheduler
+from .timeline_eviction import TimelineEviction
 from .user_files import (
     Accounts, History, NewTheme, Pre070Settings, Settings, Theme, UIState,
 )
@@ -103,11 +106,20 @@ class Backend:
 
         media_cache: A matrix media cache for downloaded files.
 
+        model_cache: An on-disk cache of the rooms, members and recent events
+            of our accounts, which are restored when a client is resumed.
+
+        sync_scheduler: Coordinates the sync loops of our clients and measures
+            the event loop's lag, see `SyncScheduler`.
+
+        timeline_eviction: Unloads events of rooms that aren't being viewed
+            to limit memory usage, see `TimelineEviction`.
+
         presences: A `{user_id: Presence}` dict for storing presence info about
             matrix users registered on Mirage.
 
-        mxc_events: A dict storing media `Event` model items for any account
-            that have the same mxc URI
+        mxc_events: A registry of the media `Event` model items of all
+            accounts by mxc URI, see `MxcEvents`.
     """
 
     def __init__(self) -> None:
@@ -141,12 +153,17 @@ class Backend:
         )
 
         self.media_cache: MediaCache = MediaCache(self, cache_dir)
+        self.model_cache: ModelCache = \
+            ModelCache(self.models, cache_dir / "models.sqlite")
+
+        self.sync_scheduler:    SyncScheduler    = SyncScheduler(self)
+        self.timeline_eviction: TimelineEviction = TimelineEviction(self)
 
         self.presences: Dict[str, Presence] = {}
 
         self.concurrent_get_presence_limit = asyncio.BoundedSemaphore(8)
 
-        self.mxc_events: DefaultDict[str, List[Event]] = DefaultDict(list)
+        self.mxc_events: MxcEvents = MxcEvents()
 
         self.notification_avatar_cache: Dict[str, Path] = {}  # {mxc: path}
         self.notifications_working:     bool            = True
@@ -350,6 +367,8 @@ class Backend:
         log.info("Setting clients offline...")
         tasks = [client.terminate() for client in self.clients.values()]
         await asyncio.gather(*tasks)
+        await self.model_cache.flush()
+        await self.media_cache.flush()
 
 
     async def get_client(self, user_id: str, _debug_info=None) -> MatrixClient:
@@ -385,7 +404,6 @@ class Backend:
 
             if room:
                 room.set_fields(unreads=0, highlights=0, local_unreads=False)
-                await client.update_account_unread_counts()
 
                 if account.presence not in [
                     Presence.State.invisible, Presence.State.offline,
@@ -449,6 +467,14 @@ class Backend:
         )
 
 
+    async def get_sync_stats(self) -> Dict[str, Any]:
+        """Return the event loop lag and sync processing times for QML.
+
+        See `SyncScheduler.stats()`.
+        """
+        return self.sync_scheduler.stats()
+
+
     async def set_string_filter(
         self, model_id: Union[SyncId, List[str]], value: str,
     ) -> None:
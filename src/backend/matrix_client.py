@@ -11,7 +11,10 @@ import os
 import platform
 import re
 import textwrap
+import time
 import traceback
+import weakref
+from bisect import bisect_left
 from contextlib import suppress
 from copy import deepcopy
 from datetime import datetime, timedelta
@@ -19,12 +22,13 @@ from functools import partial
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 from typing import (
-    TYPE_CHECKING, Any, Callable, ClassVar, Coroutine, DefaultDict, Dict, List,
-    NamedTuple, Optional, Set, Tuple, Type, Union,
+    TYPE_CHECKING, Any, AsyncIterator, Callable, ClassVar, Coroutine,
+    DefaultDict, Dict, List, NamedTuple, Optional, Set, Tuple, Type, Union,
 )
 from urllib.parse import urlparse
 from uuid import UUID, uuid4
 
+import aiohttp
 import cairosvg
 import nio
 from nio.crypto import AsyncDataT as UploadData
@@ -40,7 +44,7 @@ from .errors import (
     UserFromOtherServerDisallowed,
 )
 from .html_markdown import HTML_PROCESSOR as HTML
-from .media_cache import Media, Thumbnail
+from .media_cache import DownloadPriority, Media, Thumbnail
 from .models.items import (
     ZERO_DATE, Account, Event, Member, PushRule, Room,
     RoomNotificationOverride, Transfer, TransferStatus, TypeSpecifier,
@@ -55,10 +59,11 @@ from .pyotherside_events import (
 if TYPE_CHECKING:
     from .backend import Backend
 
-PushAction    = Union[Dict[str, Any], nio.PushAction]
-PushCondition = Union[Dict[str, Any], nio.PushCondition]
-CryptDict     = Dict[str, Any]
-PathCallable  = Union[
+PushAction       = Union[Dict[str, Any], nio.PushAction]
+PushCondition    = Union[Dict[str, Any], nio.PushCondition]
+CryptDict        = Dict[str, Any]
+PowerLevelFields = Dict[str, Tuple[nio.PowerLevels, Dict[str, Any]]]
+PathCallable     = Union[
     str, Path, Callable[[], Coroutine[None, None, Union[str, Path]]],
 ]
 
@@ -120,6 +125,19 @@ class MatrixClient(nio.AsyncClient):
     room_id_or_alias_regex = re.compile(r"^[#!].+:.+")
     http_s_url_regex       = re.compile(r"^https?://")
 
+    # Bounds for the number of events requested by load_past_events(), and
+    # how many seconds a request should take, which the number is adapted to
+    min_past_events_page:    ClassVar[int]   = 20
+    max_past_events_page:    ClassVar[int]   = 250
+    past_events_target_time: ClassVar[float] = 1
+
+    # Seconds after which a prefetched page of past events that wasn't used
+    # by load_past_events() is dropped
+    past_events_prefetch_expiry: ClassVar[float] = 300
+
+    # Read receipts kept at most for events and members we haven't loaded yet
+    max_unassigned_receipts: ClassVar[int] = 5000
+
     lazy_load_filter: ClassVar[Dict[str, Any]] = {
         "room": {
             "ephemeral":    {"lazy_load_members": True},
@@ -212,14 +230,37 @@ class MatrixClient(nio.AsyncClient):
         self.loaded_once_rooms:    Set[str]       = set()  # {room_id}
         self.cleared_events_rooms: Set[str]       = set()  # {room_id}
         self.ignored_rooms:        Set[str]       = set()  # {room_id}
+        self.cached_rooms:         Set[str]       = set()  # {room_id}
+
+        # {room_id: set once past_tokens has a token for the room}
+        self.past_tokens_known: DefaultDict[str, asyncio.Event] = \
+            DefaultDict(asyncio.Event)
+
+        # {room_id: running load_past_events() or prefetched page task}
+        self.past_events_tasks:    Dict[str, asyncio.Future] = {}
+        self.past_events_prefetch: Dict[str, asyncio.Future] = {}
+
+        # Adapted to the server's response times, see load_past_events()
+        self.past_events_page: int = 100
+
+        # {room_id: [(oldest event date, token to load older events)]} -
+        # first for the initial sync's timeline, then for every loaded page
+        self.past_pages: Dict[str, List[Tuple[datetime, str]]] = {}
 
         self.event_to_echo_ids: Dict[str, str] = {}
 
         # {(room_id, user_id): event_id}
         self.unassigned_member_last_read_event: Dict[Tuple[str, str], str] = {}
 
+        # {user_id: {room_id: Member}} - see add_member() and remove_member()
+        self.members_by_user: DefaultDict[str, Dict[str, Member]] = \
+            DefaultDict(dict)
+
         # {event_id: {user_id: server_timestamp}}
-        self.unassigned_event_last_read_by: DefaultDict[str, Dict[str, int]] =\
+        self.unassigned_event_last_read_by: Dict[str, Dict[str, int]] = {}
+
+        # {room_id: {event_id: new last_read_by}} - see apply_read_receipts()
+        self.pending_read_by: DefaultDict[str, Dict[str, Dict[str, int]]] = \
             DefaultDict(dict)
 
         self.push_rules:       nio.PushRulesEvent = nio.PushRulesEvent()
@@ -228,6 +269,14 @@ class MatrixClient(nio.AsyncClient):
         # {room_id: event}
         self.power_level_events: Dict[str, nio.PowerLevelsEvent] = {}
 
+        # {room_id: (power_levels, fields)} - see _power_level_fields()
+        self.power_level_fields: PowerLevelFields = {}
+
+        # Whether a sync response is being processed, and {room_id} of
+        # rooms to update when done - see register_nio_room()
+        self.processing_sync:              bool     = False
+        self.rooms_to_register_after_sync: Set[str] = set()
+
         self.invalid_disconnecting: bool = False
 
         self.nio_callbacks = NioCallbacks(self)
@@ -254,6 +303,47 @@ class MatrixClient(nio.AsyncClient):
         return f"{__display_name__} on {os_name} {os_ver}".rstrip()
 
 
+    async def sync(self, *args, **kwargs) -> nio.SyncResponse:
+        """Sync, after waiting if `Backend.sync_scheduler` requires it."""
+
+        await self.backend.sync_scheduler.wait_before_sync(self.user_id)
+        return await super().sync(*args, **kwargs)
+
+
+    async def receive_response(self, response: nio.Response) -> None:
+        """Update the client state for a response.
+
+        Sync responses are processed when `Backend.sync_scheduler` allows
+        it, starting with the room shown in the UI if any. Repeated
+        presence events for the same user are coalesced.
+        See also `register_nio_room`.
+        """
+
+        if not isinstance(response, nio.SyncResponse):
+            await super().receive_response(response)
+            return
+
+        scheduler        = self.backend.sync_scheduler
+        user_id, room_id = scheduler.visible_user_and_room
+        joined           = response.rooms.join
+
+        if user_id == self.user_id and room_id in joined:
+            response.rooms.join = {room_id: joined.pop(room_id), **joined}
+
+        # Only the last presence event of each user matters
+        presences                = response.presence_events
+        latest                   = {ev.user_id: ev for ev in presences}
+        response.presence_events = list(latest.values())
+
+        async with scheduler.processing(self.user_id):
+            self.processing_sync = True
+
+            try:
+                await super().receive_response(response)
+            finally:
+                self.processing_sync = False
+
+
     async def _send(self, *args, **kwargs) -> nio.Response:
         """Raise a `MatrixError` subclass for any `nio.ErrorResponse`.
 
@@ -265,19 +355,25 @@ class MatrixClient(nio.AsyncClient):
         response = await super()._send(*args, **kwargs)
 
         if isinstance(response, nio.ErrorResponse):
-            try:
-                raise await MatrixError.from_nio(response)
-            except MatrixInvalidAccessToken:
-                if not self.invalid_disconnecting:
-                    self.invalid_disconnecting = True
-                    InvalidAccessToken(self.user_id)
-                    await self.backend.logout_client(self.user_id)
-
-                raise
+            await self._raise_error(response)
 
         return response
 
 
+    async def _raise_error(self, response: nio.ErrorResponse) -> None:
+        """Raise a `MatrixError` for a response, logout if token is invalid."""
+
+        try:
+            raise await MatrixError.from_nio(response)
+        except MatrixInvalidAccessToken:
+            if not self.invalid_disconnecting:
+                self.invalid_disconnecting = True
+                InvalidAccessToken(self.user_id)
+                await self.backend.logout_client(self.user_id)
+
+            raise
+
+
     async def login(
         self, password: Optional[str] = None, token: Optional[str] = None,
     ) -> None:
@@ -320,9 +416,14 @@ class MatrixClient(nio.AsyncClient):
         state:        str = "online",
         status_msg:   str = "",
     ) -> None:
-        """Restore a previous login to the server with a saved access token."""
+        """Restore a previous login to the server with a saved access token.
+
+        The account's rooms, members and recent events are first restored
+        from `Backend.model_cache`, to be shown until they are synced.
+        """
 
         self.restore_login(user_id, device_id, access_token)
+        self.cached_rooms = await self.backend.model_cache.load(user_id)
 
         account        = self.models["accounts"][user_id]
         self._presence = "offline" if state == "invisible" else state
@@ -451,6 +552,10 @@ class MatrixClient(nio.AsyncClient):
                 with suppress(asyncio.CancelledError):
                     await task
 
+        for task in self.past_events_prefetch.values():
+            task.cancel()
+
+        self.past_events_prefetch.clear()
         self.first_sync_done.clear()
 
 
@@ -571,8 +676,6 @@ class MatrixClient(nio.AsyncClient):
                         if event.sender_id in now_ignored:
                             del event_model[event_id]
 
-        await self.update_account_unread_counts()
-
 
     async def ignore_user(self, user_id: str, ignore: bool) -> None:
         current = self.ignored_user_ids
@@ -641,7 +744,8 @@ class MatrixClient(nio.AsyncClient):
             to: Event = \
                 self.models[self.user_id, room_id, "events"][reply_to_event_id]
 
-            source_body = getattr(to.source, "body", "")
+            to_source   = to.nio_source
+            source_body = getattr(to_source, "body", "")
 
             content["format"] = "org.matrix.custom.html"
             plain_source_body = "\n".join(
@@ -656,9 +760,9 @@ class MatrixClient(nio.AsyncClient):
                 event_id  = to.event_id,
                 user_id   = to.sender_id,
                 content   =
-                    getattr(to.source, "formatted_body", "") or
+                    getattr(to_source, "formatted_body", "") or
                     source_body or
-                    html.escape(to.source.source["type"] if to.source else ""),
+                    html.escape(to_source.source["type"] if to_source else ""),
 
                 reply_content = to_html,
             )
@@ -1092,15 +1196,23 @@ class MatrixClient(nio.AsyncClient):
             await self.register_nio_room(room, force_register_members=True)
 
 
-    async def load_past_events(self, room_id: str) -> bool:
+    async def load_past_events(self, room_id: str, wanted: int = 0) -> bool:
         """Ask the server for previous events of the room.
 
         If it's the first time that the room is being loaded, 10 events
-        will be requested (to give the user something to read quickly), else
-        100 events will be requested.
+        will be requested (to give the user something to read quickly).
+        Later requests ask for a number of events adapted to how fast the
+        server responds, so that they take about `past_events_target_time`.
+        Either way, at least `wanted` events are requested, e.g. the number
+        of events that can fit on screen.
 
         Events from before the client was started will be requested and
         registered into our models.
+        Concurrent calls for the same room share a single request.
+        If `wanted` is more than 0, like when the timeline is scrolled near
+        its top, the next page is fetched in the background for the next
+        call once events are registered. The room list, which only needs
+        a room's last event, passes no `wanted` and never prefetches.
 
         Returns whether there are any messages left to load.
         """
@@ -1111,34 +1223,199 @@ class MatrixClient(nio.AsyncClient):
            self.models[self.user_id, "rooms"][room_id].left:
             return False
 
-        await self.first_sync_done.wait()
+        task = self.past_events_tasks.get(room_id)
+
+        if not task:
+            task = asyncio.ensure_future(
+                self._load_past_events(room_id, wanted),
+            )
+            self.past_events_tasks[room_id] = task
+
+        # Shielded, as QML cancelling its call must not cancel other callers'
+        return await asyncio.shield(task)
+
+
+    async def _load_past_events(self, room_id: str, wanted: int) -> bool:
+        try:
+            await self.first_sync_done.wait()
 
-        while not self.past_tokens.get(room_id):
             # If a new room was added, wait for onSyncResponse to set the token
-            await asyncio.sleep(0.1)
+            await self.past_tokens_known[room_id].wait()
+
+            response = None
+            prefetch = self.past_events_prefetch.pop(room_id, None)
+
+            if prefetch:
+                # Failures are logged by the prefetch's done callback
+                with suppress(Exception):
+                    response = await prefetch
+
+            if not response:
+                if room_id in self.loaded_once_rooms:
+                    limit = max(self.past_events_page, wanted)
+                else:
+                    limit = max(10, wanted)
+
+                limit    = min(limit, self.max_past_events_page)
+                response = await self._fetch_past_events(room_id, limit)
+
+            self.loaded_once_rooms.add(room_id)
+            more_to_load = True
 
+            self.past_tokens[room_id] = response.end
+            oldest                    = self.past_pages[room_id][-1][0]
+
+            for event in response.chunk:
+                date   = datetime.fromtimestamp(event.server_timestamp / 1000)
+                oldest = min(oldest, date)
+
+                if isinstance(event, nio.RoomCreateEvent):
+                    self.fully_loaded_rooms.add(room_id)
+                    more_to_load = False
+
+                for cb in self.event_callbacks:
+                    if (cb.filter is None or isinstance(event, cb.filter)):
+                        await cb.func(self.all_rooms[room_id], event)
+
+            self.past_pages[room_id].append((oldest, response.end))
+
+            if more_to_load and wanted:
+                self._prefetch_past_events(room_id)
+
+            return more_to_load
+
+        finally:
+            if self.past_events_tasks.get(room_id) is utils.current_task():
+                del self.past_events_tasks[room_id]
+
+
+    def _prefetch_past_events(self, room_id: str) -> None:
+        """Fetch the next page of past events in the background.
+
+        The page is used by the next `load_past_events()` call for the room,
+        unless `past_events_prefetch_expiry` seconds pass before that.
+        If fetching fails, the error is logged and the page is dropped.
+        """
+
+        prefetch = asyncio.ensure_future(
+            self._fetch_past_events(room_id, self.past_events_page),
+        )
+        ref = weakref.ref(prefetch)  # Don't keep it alive once used
+
+        def forget(future: asyncio.Future) -> bool:
+            if self.past_events_prefetch.get(room_id) is future:
+                del self.past_events_prefetch[room_id]
+                return True
+
+            return False
+
+        def expire() -> None:
+            future = ref()
+
+            if future and forget(future):
+                future.cancel()
+
+        def on_done(future: asyncio.Future) -> None:
+            err = None if future.cancelled() else future.exception()
+
+            if err:
+                forget(future)
+                expiry.cancel()
+
+                trace = "".join(traceback.format_exception(
+                    type(err), err, err.__traceback__,
+                )).rstrip()
+                log.warning("Prefetching events failed: %s", trace)
+
+        expiry = asyncio.get_event_loop().call_later(
+            self.past_events_prefetch_expiry, expire,
+        )
+        prefetch.add_done_callback(on_done)
+        self.past_events_prefetch[room_id] = prefetch
+
+
+    def evict_past_events(self, room_id: str, keep: int) -> int:
+        """Unload the oldest pages of events loaded for a room.
+
+        Pages loaded by `load_past_events()` are unloaded from the oldest,
+        as long as at least `keep` events remain. `past_tokens` is moved
+        back to the oldest page still loaded, so that the unloaded events
+        can be loaded again later.
+
+        Returns the number of events that were unloaded.
+        """
+
+        pages = self.past_pages.get(room_id)
+        model = self.models.data.get((self.user_id, room_id, "events"))
+
+        if not pages or not model or room_id in self.past_events_tasks:
+            return 0
+
+        if len(model) < keep:
+            return 0
+
+        # Pages go from the newest to the oldest, count how many events
+        # are at least as recent as each page's oldest event
+        dates = sorted(ev.date for ev in model.values())
+        kept  = len(pages)
+
+        while kept > 1:
+            boundary = pages[kept - 2][0]
+
+            if len(dates) - bisect_left(dates, boundary) < keep:
+                break
+
+            kept -= 1
+
+        if kept == len(pages):
+            return 0
+
+        boundary, token = pages[kept - 1]
+        old             = [k for k, ev in model.items() if ev.date < boundary]
+
+        with model.batch_remove():
+            for key in old:
+                del model[key]
+
+        del pages[kept:]
+        self.past_tokens[room_id] = token
+        self.fully_loaded_rooms.discard(room_id)
+
+        prefetch = self.past_events_prefetch.pop(room_id, None)
+
+        if prefetch:
+            prefetch.cancel()
+
+        return len(old)
+
+
+    async def _fetch_past_events(
+        self, room_id: str, limit: int,
+    ) -> nio.RoomMessagesResponse:
+        """Request events before `past_tokens[room_id]` without using them.
+
+        `past_events_page` is adapted based on how long the request took.
+        """
+
+        start    = time.monotonic()
         response = await self.room_messages(
             room_id        = room_id,
             start          = self.past_tokens[room_id],
-            limit          = 100 if room_id in self.loaded_once_rooms else 10,
+            limit          = limit,
             message_filter = self.lazy_load_filter,
         )
+        took = time.monotonic() - start
 
-        self.loaded_once_rooms.add(room_id)
-        more_to_load = True
-
-        self.past_tokens[room_id] = response.end
-
-        for event in response.chunk:
-            if isinstance(event, nio.RoomCreateEvent):
-                self.fully_loaded_rooms.add(room_id)
-                more_to_load = False
+        if took > 0:
+            ideal = limit * self.past_events_target_time / took
+            page  = round((self.past_events_page + ideal) / 2)
 
-            for cb in self.event_callbacks:
-                if (cb.filter is None or isinstance(event, cb.filter)):
-                    await cb.func(self.all_rooms[room_id], event)
+            self.past_events_page = max(
+                self.min_past_events_page,
+                min(self.max_past_events_page, page),
+            )
 
-        return more_to_load
+        return response
 
 
     async def new_direct_chat(self, invite: str, encrypt: bool = False) -> str:
@@ -1234,8 +1511,6 @@ class MatrixClient(nio.AsyncClient):
         self.models.pop((self.user_id, room_id, "events"), None)
         self.models.pop((self.user_id, room_id, "members"), None)
 
-        await self.update_account_unread_counts()
-
         try:
             await super().room_leave(room_id)
         except MatrixError as e:  # room was already left
@@ -1504,6 +1779,75 @@ class MatrixClient(nio.AsyncClient):
         return (thumb_data, info)
 
 
+    async def download_chunks(
+        self, server_name: str, media_id: str, chunk_size: int = 256 * 1024,
+    ) -> AsyncIterator[bytes]:
+        """Download a media file from the server piece by piece.
+
+        Unlike `download()`, which returns a response containing the whole
+        file, this yields the file's data as it is received, in pieces of
+        `chunk_size` bytes (the last one can be smaller).
+
+        Since nio's `_send()` would read the whole response, its handling
+        of rate limits and connection errors is reproduced here: the request
+        is retried until it succeeds or the client config's limits are hit.
+        """
+
+        method, path = nio.Api.download(server_name, media_id)
+        headers      = {"Authorization": f"Bearer {self.access_token}"}
+        got_429      = 0
+        got_timeouts = 0
+
+        while True:
+            try:
+                response = await self.send(
+                    method, path, None, headers, timeout=0,
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                got_timeouts += 1
+                max_timeouts  = self.config.max_timeouts
+
+                if max_timeouts is not None and got_timeouts > max_timeouts:
+                    raise
+
+                wait = await self.get_timeout_retry_wait_time(got_timeouts)
+                log.warning("Download timed out, retrying in %ds", wait)
+                await asyncio.sleep(wait)
+                continue
+
+            if response.status == 200:
+                break
+
+            try:
+                try:
+                    content = await response.json(content_type=None)
+                except ValueError:
+                    content = {}
+
+                error                    = nio.DownloadError.from_dict(content)
+                error.transport_response = response
+
+                limit   = self.config.max_limit_exceeded
+                limited = error.status_code == "M_LIMIT_EXCEEDED" or \
+                    response.status == 429
+
+                if not limited or (limit is not None and got_429 >= limit):
+                    await self._raise_error(error)
+            finally:
+                response.release()
+
+            got_429 += 1
+            wait     = (content.get("retry_after_ms") or 5000) / 1000
+            log.warning("Download rate-limited, retrying in %ss", wait)
+            await asyncio.sleep(wait)
+
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            response.release()
+
+
     async def upload(
         self,
         data_provider: nio.DataProvider,
@@ -1681,21 +2025,33 @@ class MatrixClient(nio.AsyncClient):
                 for ev in model.values():
                     room = self.all_rooms[room_id]
 
-                    if isinstance(ev.source, nio.MegolmEvent):
-                        try:
-                            decrypted = self.decrypt_event(ev.source)
+                    if not (isinstance(ev.event_type, type) and
+                            issubclass(ev.event_type, nio.MegolmEvent)):
+                        continue
+
+                    # Compacted events (rooms not shown) have no `source`
+                    source = ev.nio_source
+
+                    if not isinstance(source, nio.MegolmEvent):
+                        continue
+
+                    if not source.room_id:
+                        source.room_id = room_id
 
-                            if not decrypted:
-                                raise nio.EncryptionError()
+                    try:
+                        decrypted = self.decrypt_event(source)
 
-                        except nio.EncryptionError:
-                            continue
+                        if not decrypted:
+                            raise nio.EncryptionError()
 
-                        for callback in self.event_callbacks:
-                            filter_ = callback.filter
-                            if not filter_ or isinstance(decrypted, filter_):
-                                coro = asyncio.coroutine(callback.func)
-                                await coro(room, decrypted)
+                    except nio.EncryptionError:
+                        continue
+
+                    for callback in self.event_callbacks:
+                        filter_ = callback.filter
+                        if not filter_ or isinstance(decrypted, filter_):
+                            coro = asyncio.coroutine(callback.func)
+                            await coro(room, decrypted)
 
 
     async def clear_events(self, room_id: str) -> None:
@@ -1706,6 +2062,11 @@ class MatrixClient(nio.AsyncClient):
 
         self.cleared_events_rooms.add(room_id)
 
+        prefetch = self.past_events_prefetch.pop(room_id, None)
+
+        if prefetch:
+            prefetch.cancel()
+
         model = self.models[self.user_id, room_id, "events"]
         if model:
             model.clear()
@@ -2042,28 +2403,6 @@ class MatrixClient(nio.AsyncClient):
 
     # Functions to register/modify data into models
 
-    async def update_account_unread_counts(self) -> None:
-        """Recalculate total unread notifications/highlights for our account"""
-
-        unreads       = 0
-        highlights    = 0
-        local_unreads = False
-
-        for room in self.models[self.user_id, "rooms"].values():
-            unreads    += room.unreads
-            highlights += room.highlights
-
-            if room.local_unreads:
-                local_unreads = True
-
-        account = self.models["accounts"][self.user_id]
-        account.set_fields(
-            total_unread     = unreads,
-            total_highlights = highlights,
-            local_unreads    = local_unreads,
-        )
-
-
     async def event_is_past(self, ev: Union[nio.Event, Event]) -> bool:
         """Return whether an event was created before this client started."""
 
@@ -2113,38 +2452,44 @@ class MatrixClient(nio.AsyncClient):
         left:                   bool = False,
         force_register_members: bool = False,
     ) -> None:
-        """Register/update a `nio.MatrixRoom` as a `models.items.Room`."""
+        """Register/update a `nio.MatrixRoom` as a `models.items.Room`.
+
+        While a sync response is being processed, rooms that are already
+        registered are only marked to be updated by
+        `NioCallbacks.onSyncResponse`, after all their new events have
+        been handled.
+        """
+
+        rooms_model = self.models[self.user_id, "rooms"]
+        from_cache  = room.room_id in self.cached_rooms
+
+        if self.processing_sync and not (left or force_register_members):
+            if room.room_id in rooms_model and not from_cache:
+                self.rooms_to_register_after_sync.add(room.room_id)
+                return
 
         self.ignored_rooms.discard(room.room_id)
 
-        inviter        = getattr(room, "inviter", "") or ""
-        levels         = room.power_levels
-        can_send_state = partial(levels.can_user_send_state, self.user_id)
-        can_send_msg   = partial(levels.can_user_send_message, self.user_id)
+        inviter = getattr(room, "inviter", "") or ""
 
         try:
-            registered = self.models[self.user_id, "rooms"][room.room_id]
+            registered = rooms_model[room.room_id]
         except KeyError:
-            registered                   = None
-            sort_overrides               = {}
-            last_event_date              = datetime.fromtimestamp(0)
-            typing_members               = []
-            local_unreads                = False
-            update_account_unread_counts = True
-            unverified_devices           = (
+            registered         = None
+            sort_overrides     = {}
+            last_event_date    = datetime.fromtimestamp(0)
+            typing_members     = []
+            local_unreads      = False
+            unverified_devices = (
                 False
                 if isinstance(room, nio.MatrixInvitedRoom) else
                 self.room_contains_unverified(room.room_id)
             )
         else:
-            sort_overrides               = registered._sort_overrides
-            last_event_date              = registered.last_event_date
-            typing_members               = registered.typing_members
-            local_unreads                = registered.local_unreads
-            update_account_unread_counts = (
-                registered.unreads != room.unread_notifications or
-                registered.highlights != room.unread_highlights
-            )
+            sort_overrides     = registered._sort_overrides
+            last_event_date    = registered.last_event_date
+            typing_members     = registered.typing_members
+            local_unreads      = registered.local_unreads
             unverified_devices = registered.unverified_devices
 
         notification_setting = RoomNotificationOverride.UseDefaultSettings
@@ -2167,19 +2512,25 @@ class MatrixClient(nio.AsyncClient):
                 notification_setting = RoomNotificationOverride.AllEvents
                 break
 
+        if registered and registered.plain_topic == (room.topic or ""):
+            topic = registered.topic
+        else:
+            topic = HTML.filter(
+                utils.plain2html(room.topic or ""), inline=True,
+            )
+
         pinned = self.backend.settings.RoomList.Pinned
 
-        room_item = Room(
+        rooms_model.upsert(
+            room.room_id,
+            Room,
             id             = room.room_id,
             for_account    = self.user_id,
             given_name     = room.name or "",
             display_name   = room.display_name or "",
             avatar_url     = room.gen_avatar_url or "",
             plain_topic    = room.topic or "",
-            topic          = HTML.filter(
-                utils.plain2html(room.topic or ""),
-                inline = True,
-            ),
+            topic          = topic,
             inviter_id     = inviter,
             inviter_name   = room.user_name(inviter) if inviter else "",
             inviter_avatar =
@@ -2193,19 +2544,7 @@ class MatrixClient(nio.AsyncClient):
             invite_required    = room.join_rule == "invite",
             guests_allowed     = room.guest_access == "can_join",
 
-            default_power_level  = levels.defaults.users_default,
-            own_power_level      = levels.get_user_level(self.user_id),
-            can_invite           = levels.can_user_invite(self.user_id),
-            can_kick             = levels.can_user_kick(self.user_id),
-            can_redact_all       = levels.can_user_redact(self.user_id),
-            can_send_messages    = can_send_msg(),
-            can_set_name         = can_send_state("m.room.name"),
-            can_set_topic        = can_send_state("m.room.topic"),
-            can_set_avatar       = can_send_state("m.room.avatar"),
-            can_set_encryption   = can_send_state("m.room.encryption"),
-            can_set_join_rules   = can_send_state("m.room.join_rules"),
-            can_set_guest_access = can_send_state("m.room.guest_access"),
-            can_set_power_levels = can_send_state("m.room.power_levels"),
+            **self._power_level_fields(room),
 
             last_event_date = last_event_date,
 
@@ -2220,23 +2559,68 @@ class MatrixClient(nio.AsyncClient):
             _sort_overrides = sort_overrides,
         )
 
-        self.models[self.user_id, "rooms"][room.room_id] = room_item
+        # Members restored from the cache may be outdated
+        self.cached_rooms.discard(room.room_id)
+
+        if not registered or from_cache or force_register_members:
+            await self.add_all_members(room)
 
-        if not registered or force_register_members:
-            model = self.models[self.user_id, room.room_id, "members"]
 
-            # The members we initially get from lazy sync may be outdated
-            # and contain members that already left.
-            # tuple() used to avoid "dict changed size during iteration".
-            for member_id in tuple(model):
-                if member_id not in room.users:
-                    await self.remove_member(room, member_id)
+    def _power_level_fields(self, room: nio.MatrixRoom) -> Dict[str, Any]:
+        """Return the `Room` fields derived from a room's power levels.
+
+        Results are cached in `power_level_fields` until a new
+        `PowerLevelsEvent` is received for the room, or nio replaces the
+        room's `PowerLevels` object (e.g. when an invite is accepted).
+        """
+
+        levels = room.power_levels
+        cached = self.power_level_fields.get(room.room_id)
+
+        if cached and cached[0] is levels:
+            return cached[1]
+
+        can_send_state = partial(levels.can_user_send_state, self.user_id)
+        can_send_msg   = partial(levels.can_user_send_message, self.user_id)
+
+        fields = {
+            "default_power_level":  levels.defaults.users_default,
+            "own_power_level":      levels.get_user_level(self.user_id),
+            "can_invite":           levels.can_user_invite(self.user_id),
+            "can_kick":             levels.can_user_kick(self.user_id),
+            "can_redact_all":       levels.can_user_redact(self.user_id),
+            "can_send_messages":    can_send_msg(),
+            "can_set_name":         can_send_state("m.room.name"),
+            "can_set_topic":        can_send_state("m.room.topic"),
+            "can_set_avatar":       can_send_state("m.room.avatar"),
+            "can_set_encryption":   can_send_state("m.room.encryption"),
+            "can_set_join_rules":   can_send_state("m.room.join_rules"),
+            "can_set_guest_access": can_send_state("m.room.guest_access"),
+            "can_set_power_levels": can_send_state("m.room.power_levels"),
+        }
 
-            for user_id in room.users:
-                await self.add_member(room, user_id)
+        self.power_level_fields[room.room_id] = (levels, fields)
+        return fields
 
-        if update_account_unread_counts:
-            await self.update_account_unread_counts()
+
+    def apply_read_receipts(self, room_id: str) -> None:
+        """Update the events of a room whose readers changed.
+
+        While a sync response is processed, `NioCallbacks.onReceiptEvent`
+        accumulates the changes in `pending_read_by`, so that each event is
+        updated only once per sync, no matter how many receipts it got.
+        """
+
+        pending = self.pending_read_by.pop(room_id, {})
+        model   = self.models.data.get((self.user_id, room_id, "events"))
+
+        for event_id, read_by in pending.items():
+            event = model.get(event_id) if model else None
+
+            if event:
+                event.set_fields(
+                    last_read_by = read_by, read_by_count = len(read_by),
+                )
 
 
     async def add_member(self, room: nio.MatrixRoom, user_id: str) -> None:
@@ -2255,7 +2639,9 @@ class MatrixClient(nio.AsyncClient):
         else:
             last_read_event = registered.last_read_event
 
-        member_item = Member(
+        member_item = member_model.upsert(
+            user_id,
+            Member,
             id              = user_id,
             display_name    = room.user_name(user_id)  # disambiguated
                               if member.display_name else "",
@@ -2267,19 +2653,76 @@ class MatrixClient(nio.AsyncClient):
             last_read_event = last_read_event,
         )
 
+        self.members_by_user[user_id][room_id] = member_item
+
         # Associate presence with member, if it exists
         if presence:
             presence.members[room_id] = member_item
+            presence.update_member(member_item)
+
+
+    async def add_all_members(self, room: nio.MatrixRoom) -> None:
+        """Register all members of a room at once, replacing existing ones.
+
+        Unlike calling `add_member()` for every member, which is too slow
+        for rooms with thousands of members, all `Member` items are
+        created first and then put in the model with a single
+        `Model.reset()`. Their presence fields are set on creation, rather
+        than having each `Presence` update all its members again.
+        """
+
+        room_id    = room.room_id
+        model      = self.models[self.user_id, room_id, "members"]
+        presences  = self.backend.presences
+        unassigned = self.unassigned_member_last_read_event
+        members    = {}
+
+        # The members we initially get from lazy sync may be outdated
+        # and contain members that already left, which the reset removes.
+        for user_id, member in room.users.items():
+            try:
+                last_read_event = model[user_id].last_read_event
+            except KeyError:
+                last_read_event = unassigned.pop((room_id, user_id), "")
+
+            presence = presences.get(user_id, None)
+            item     = Member(
+                id              = user_id,
+                display_name    = room.user_name(user_id)  # disambiguated
+                                  if member.display_name else "",
+                avatar_url      = member.avatar_url or "",
+                typing          = user_id in room.typing_users,
+                ignored         = user_id in self.ignored_user_ids,
+                power_level     = member.power_level,
+                invited         = member.invited,
+                last_read_event = last_read_event,
+            )
+
+            if presence:
+                presence.members[room_id] = item
+                presence.update_member(item)
+
+            members[user_id]                       = item
+            self.members_by_user[user_id][room_id] = item
 
-            # And then update presence fields
-            presence.update_members()
+        left = model.keys() - members.keys()
 
-        member_model[user_id] = member_item
+        for user_id in left:
+            self._forget_member(room_id, user_id)
+
+        model.reset(members)
+
+        room_item = self.models[self.user_id, "rooms"].get(room_id)
+
+        if left and room_item:
+            room_item.unverified_devices = \
+                self.room_contains_unverified(room_id)
 
 
     async def remove_member(self, room: nio.MatrixRoom, user_id: str) -> None:
         """Remove a room member from our models."""
 
+        self._forget_member(room.room_id, user_id)
         self.models[self.user_id, room.room_id, "members"].pop(user_id, None)
 
         room_item = self.models[self.user_id, "rooms"].get(room.room_id)
@@ -2289,6 +2732,20 @@ class MatrixClient(nio.AsyncClient):
                 self.room_contains_unverified(room.room_id)
 
 
+    def _forget_member(self, room_id: str, user_id: str) -> None:
+        """Unlink a member that is being removed from its `Presence`."""
+
+        by_room  = self.members_by_user.get(user_id, {})
+        member   = by_room.pop(room_id, None)
+        presence = self.backend.presences.get(user_id, None)
+
+        if not by_room:
+            self.members_by_user.pop(user_id, None)
+
+        if member and presence and presence.members.get(room_id) is member:
+            del presence.members[room_id]
+
+
     async def get_event_profiles(self, room_id: str, event_id: str) -> None:
         """Fetch from network an event's sender, target and remover's profile.
 
@@ -2359,31 +2816,37 @@ class MatrixClient(nio.AsyncClient):
 
         avatar_size = (48, 48)
 
-        avatar_path = await Thumbnail(
+        thumbnail = Thumbnail(
             cache          = self.backend.media_cache,
             client_user_id = self.user_id,
             mxc            = mxc,
             title          = f"user_{user_id}.notification",
             wanted_size    = avatar_size,
-        ).get()
-
-        image_data = None
-        create     = False
+            priority       = DownloadPriority.Avatar,
+        )
+        avatar_path = await thumbnail.get()
 
-        async with utils.aiopen(avatar_path, "rb") as file:
-            if await utils.is_svg(file):
-                await file.seek(0, 0)
+        try:
+            async with utils.aiopen(avatar_path, "rb") as file:
+                image_data = await file.read()
+        except FileNotFoundError:
+            # Deleted by something else than us, download it again
+            await self.backend.media_cache.forget(avatar_path)
+            avatar_path = await thumbnail.get()
 
-                create     = True
-                image_data = cairosvg.svg2png(
-                    bytestring    = await file.read(),
-                    parent_width  = avatar_size[0],
-                    parent_height = avatar_size[1],
-                )
-            else:
-                await file.seek(0, 0)
+            async with utils.aiopen(avatar_path, "rb") as file:
                 image_data = await file.read()
 
+        create = False
+
+        if await utils.is_svg(image_data):
+            create     = True
+            image_data = cairosvg.svg2png(
+                bytestring    = image_data,
+                parent_width  = avatar_size[0],
+                parent_height = avatar_size[1],
+            )
+
         pil_image = PILImage.open(io.BytesIO(image_data))
 
         if pil_image.size != avatar_size:
@@ -2502,13 +2965,11 @@ class MatrixClient(nio.AsyncClient):
             return item
 
         if await self.event_is_past(ev):
-            await self.update_account_unread_counts()
             return item
 
         if self.backend.settings.RoomList.local_unread_markers:
             room_item = self.models[self.user_id, "rooms"][room.room_id]
             room_item.local_unreads = True
-            await self.update_account_unread_counts()
 
         # Alerts & notifications
 
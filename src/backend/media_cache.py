@@ -4,23 +4,41 @@
 """Matrix media downloading, caching and retrieval."""
 
 import asyncio
+import binascii
 import functools
+import heapq
 import io
+import itertools
+import logging as log
+import os
 import re
 import shutil
+import sqlite3
 import sys
+import time
+import traceback
+import weakref
 from dataclasses import dataclass, field
+from enum import IntEnum
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, DefaultDict, Dict, Optional
+from typing import (
+    TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, ClassVar, Dict,
+    Iterator, List, Optional, Set, Tuple, Union,
+)
 from urllib.parse import urlparse
 from uuid import uuid4
 
 import nio
+import unpaddedbase64
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Util import Counter
 from PIL import Image as PILImage
 
-from .models.items import Transfer, TransferStatus
+from .models.items import Event, Transfer, TransferStatus
 from .models.model import Model
-from .utils import Size, atomic_write, current_task
+from .pyotherside_events import LoopException
+from .utils import Size, asynccontextmanager, atomic_write, current_task
 
 if TYPE_CHECKING:
     from .backend import Backend
@@ -28,17 +46,61 @@ if TYPE_CHECKING:
 if sys.version_info < (3, 8):
     import pyfastcopy  # noqa
 
-CONCURRENT_DOWNLOADS_LIMIT                   = asyncio.BoundedSemaphore(8)
-ACCESS_LOCKS: DefaultDict[str, asyncio.Lock] = DefaultDict(asyncio.Lock)
+# {path relative to the cache dir: (directory name, mxc, access time)}
+Accesses = Dict[str, Tuple[str, str, float]]
+
+INDEX_SCHEMA_VERSION = 2
+
+# mxc is NULL for files found on disk whose mxc isn't known yet
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT    NOT NULL PRIMARY KEY,
+    directory   TEXT    NOT NULL,
+    mxc         TEXT,
+    size        INTEGER NOT NULL,
+    last_access REAL    NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS files_by_access ON files (directory, last_access);
+"""
 
 
 @dataclass
 class MediaCache:
-    """Matrix downloaded media cache."""
+    """Matrix downloaded media cache.
+
+    The size, mxc and last access time of every file in the `downloads` and
+    `thumbnails` directories are recorded in an SQLite index.
+    Every `eviction_interval` seconds, accesses since the last check are
+    written to the index, and if the files in a directory take more space
+    than allowed by the `Chat.Files.max_downloads_cache_size` or
+    `max_thumbnails_cache_size` setting, the least recently accessed ones
+    are deleted.
+
+    Files for the media of `Event` items that are loaded in a model or
+    registered in `Backend.mxc_events`, and cached notification avatars,
+    are never deleted. Neither are files whose mxc is unknown because they
+    weren't accessed since they were indexed (see `_scan()`), which don't
+    count toward the size limits.
+
+    The paths of existing files are also kept in memory, so that once the
+    files present at startup have been indexed, `is_cached()` doesn't need
+    to touch the filesystem. If a file turns out to have been deleted by
+    something else than us when it is opened, `forget()` must be called.
+    """
 
     backend:  "Backend" = field()
     base_dir: Path      = field()
 
+    eviction_interval: ClassVar[float] = 60
+
+    _accesses: Accesses = field(init=False, repr=False, default_factory=dict)
+
+    # str() of the absolute paths of files known to exist in the cache
+    _files: Set[str] = field(init=False, repr=False, default_factory=set)
+
+    _files_indexed: bool = field(init=False, repr=False, default=False)
+
 
     def __post_init__(self) -> None:
         self.thumbs_dir    = self.base_dir / "thumbnails"
@@ -47,21 +109,643 @@ class MediaCache:
         self.thumbs_dir.mkdir(parents=True, exist_ok=True)
         self.downloads_dir.mkdir(parents=True, exist_ok=True)
 
+        self.downloads = DownloadScheduler()
+
+        self._db = sqlite3.connect(
+            str(self.base_dir / "media.sqlite"), check_same_thread=False,
+        )
+
+        with self._db:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+
+            if version != INDEX_SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS files")
+                self._db.execute(
+                    f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}",
+                )
+
+            self._db.executescript(INDEX_SCHEMA)
+
+        self._index_lock = asyncio.Lock()
+        self._evictor    = asyncio.ensure_future(self._run())
+
+
+    def is_cached(self, path: Union[Path, str]) -> bool:
+        """Return whether a file exists in the cache."""
+
+        if self._files_indexed:
+            return str(path) in self._files
+
+        return os.path.exists(path)
+
+
+    async def forget(self, path: Union[Path, str]) -> None:
+        """Forget a cached file that couldn't be opened or loaded.
+
+        The path can be a `file://` URL, as received by QML.
+        The file will be downloaded again the next time it is needed.
+        """
+
+        path = str(path)
+
+        if path.startswith("file://"):
+            path = path[len("file://"):]
+
+        self._files.discard(path)
+
+
+    def accessed(self, path: Path, mxc: str) -> None:
+        """Record that a cached file was just used or created."""
+
+        self._files.add(str(path))
+
+        try:
+            relative = path.relative_to(self.base_dir)
+        except ValueError:
+            return
+
+        directory = relative.parts[0] if relative.parts else ""
+
+        if directory in ("downloads", "thumbnails"):
+            self._accesses[str(relative)] = (directory, mxc, time.time())
+
+
+    async def flush(self) -> None:
+        """Write the file accesses recorded since the last flush to the index.
+        """
+
+        async with self._index_lock:
+            accesses, self._accesses = self._accesses, {}
+
+            if not accesses:
+                return
+
+            gone = await asyncio.get_event_loop().run_in_executor(
+                None, self._write_accesses, accesses,
+            )
+
+        # The files may have been deleted by something else than us
+        for path in gone:
+            self._files.discard(str(self.base_dir / path))
+
+
+    async def evict(self) -> int:
+        """Delete old files as described in the class docstring.
+
+        Returns the number of files that were deleted.
+        """
+
+        settings = self.backend.settings.Chat.Files
+        budgets  = {
+            "downloads": settings.max_downloads_cache_size * 1024 ** 2,
+            "thumbnails": settings.max_thumbnails_cache_size * 1024 ** 2,
+        }
+
+        await self.flush()
+
+        async with self._index_lock:
+            deleted = await asyncio.get_event_loop().run_in_executor(
+                None, self._evict, budgets, self._referenced_mxcs(),
+            )
+
+        for path in deleted:
+            self._files.discard(str(self.base_dir / path))
+
+        if deleted:
+            log.debug("Deleted %d files from the media cache", len(deleted))
+
+        return len(deleted)
+
+
+    def _referenced_mxcs(self) -> Set[str]:
+        """Return the mxc URIs of files that must not be evicted."""
+
+        backend = self.backend
+        mxcs    = backend.mxc_events.mxcs()
+        mxcs.update(backend.notification_avatar_cache)
+
+        for sync_id, model in backend.models.data.items():
+            if isinstance(sync_id, tuple) and sync_id[-1] == "events":
+                for event in model._sorted_data:
+                    mxcs.add(event.media_url)
+                    mxcs.add(event.thumbnail_url)
+
+        mxcs.discard("")
+        return mxcs
+
+
+    async def _run(self) -> None:
+        """Index existing files, then call `evict()` periodically."""
+
+        try:
+            async with self._index_lock:
+                files = await asyncio.get_event_loop().run_in_executor(
+                    None, self._scan,
+                )
+
+            self._files.update(files)
+            self._files_indexed = True
+        except Exception as err:  # noqa
+            LoopException(str(err), err, traceback.format_exc().rstrip())
+
+        while True:
+            await asyncio.sleep(self.eviction_interval)
+
+            try:
+                await self.evict()
+            except Exception as err:  # noqa
+                LoopException(str(err), err, traceback.format_exc().rstrip())
+
+
+    def _scan(self) -> Set[str]:
+        """Sync the index with the files on disk, meant to run in a thread.
+
+        Returns the absolute paths of the existing files.
+
+        Files that aren't indexed yet, e.g. because they were downloaded by
+        an older version, are added with their modification time as last
+        access time.
+        Their mxc can't be reliably found from their name, and is only
+        recorded once they are accessed. Until then, they can't be evicted.
+        """
+
+        indexed  = {
+            path for (path,) in self._db.execute("SELECT path FROM files")
+        }
+        found:   Set[str]                                = set()
+        paths:   Set[str]                                = set()
+        missing: List[Tuple[str, str, None, int, float]] = []
+
+        for directory in ("downloads", "thumbnails"):
+            for root, _dirs, files in os.walk(self.base_dir / directory):
+                for name in files:
+                    paths.add(os.path.join(root, name))
+
+                    path     = Path(root, name)
+                    relative = str(path.relative_to(self.base_dir))
+                    found.add(relative)
+
+                    if relative in indexed:
+                        continue
+
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    size = stat.st_size
+                    missing.append(
+                        (relative, directory, None, size, stat.st_mtime),
+                    )
+
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM files WHERE path = ?",
+                [(path,) for path in indexed - found],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", missing,
+            )
+
+        return paths
+
+
+    def _write_accesses(self, accesses: Accesses) -> List[str]:
+        """Update the index for accessed files, meant to run in a thread.
+
+        Returns the paths of the files that don't exist anymore.
+        """
+
+        rows: List[Tuple[str, str, str, int, float]] = []
+        gone: List[Tuple[str]]                       = []
+
+        for path, (directory, mxc, last_access) in accesses.items():
+            try:
+                size = (self.base_dir / path).stat().st_size
+            except FileNotFoundError:
+                gone.append((path,))
+                continue
+
+            rows.append((path, directory, mxc, size, last_access))
+
+        with self._db:
+            self._db.executemany("DELETE FROM files WHERE path = ?", gone)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows,
+            )
+
+        return [path for (path,) in gone]
+
+
+    def _evict(
+        self, budgets: Dict[str, int], protected: Set[str],
+    ) -> List[str]:
+        """Delete least recently used files, meant to run in a thread.
+
+        Returns the paths of the deleted files.
+        """
+
+        deleted: List[Tuple[str]] = []
+
+        for directory, budget in budgets.items():
+            # Files with an unknown mxc can't be evicted, so they don't
+            # count toward the budget either
+            total = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM files "
+                "WHERE directory = ? AND mxc IS NOT NULL",
+                (directory,),
+            ).fetchone()[0]
+
+            if budget <= 0 or total <= budget:
+                continue
+
+            oldest = self._db.execute(
+                "SELECT path, mxc, size FROM files "
+                "WHERE directory = ? AND mxc IS NOT NULL ORDER BY last_access",
+                (directory,),
+            ).fetchall()
+
+            for path, mxc, size in oldest:
+                if total <= budget:
+                    break
+
+                if mxc in protected:
+                    continue
+
+                try:
+                    (self.base_dir / path).unlink()
+                except FileNotFoundError:
+                    pass
+
+                deleted.append((path,))
+                total -= size
+
+        with self._db:
+            self._db.executemany("DELETE FROM files WHERE path = ?", deleted)
+
+        return [path for (path,) in deleted]
+
 
-    async def get_media(self, *args) -> Path:
-        """Return `Media(self, ...).get()`'s result. Intended for QML."""
-        return await Media(self, *args).get()
+    async def get_media(
+        self,
+        client_user_id: str,
+        mxc:            str,
+        title:          str,
+        room_id:        Optional[str]            = None,
+        filesize:       Optional[int]            = None,
+        crypt_dict:     Optional[Dict[str, Any]] = None,
+        priority:       str                      = "UserDownload",
+    ) -> Path:
+        """Return `Media(self, ...).get()`'s result. Intended for QML.
+
+        `priority` is the name of a `DownloadPriority`.
+        """
+
+        return await Media(
+            self, client_user_id, mxc, title, room_id, filesize, crypt_dict,
+            DownloadPriority[priority],
+        ).get()
 
 
-    async def get_thumbnail(self, width: float, height: float, *args) -> Path:
-        """Return `Thumbnail(self, ...).get()`'s result. Intended for QML."""
+    async def get_thumbnail(
+        self,
+        width:          float,
+        height:         float,
+        client_user_id: str,
+        mxc:            str,
+        title:          str,
+        room_id:        Optional[str]            = None,
+        filesize:       Optional[int]            = None,
+        crypt_dict:     Optional[Dict[str, Any]] = None,
+        priority:       str                      = "VisibleThumbnail",
+    ) -> Path:
+        """Return `Thumbnail(self, ...).get()`'s result. Intended for QML.
+
+        `priority` is the name of a `DownloadPriority`.
+        """
+
         # QML sometimes pass float sizes, which matrix API doesn't like.
         size = (round(width), round(height))
         return await Thumbnail(
-            self, *args, wanted_size=size,  # type: ignore
+            self, client_user_id, mxc, title, room_id, filesize, crypt_dict,
+            DownloadPriority[priority], wanted_size=size,
         ).get()
 
 
+class DownloadPriority(IntEnum):
+    """Kinds of media downloads, from the most to the least urgent."""
+
+    VisibleThumbnail = 0  # Thumbnails and images shown in the timeline
+    Avatar           = 1
+    UserDownload     = 2  # Files opened by the user, full size images
+    Prefetch         = 3  # Files nothing is waiting for yet
+
+
+# (priority, queue order, homeserver, future set when it can start)
+QueuedDownload = Tuple[DownloadPriority, int, str, asyncio.Future]
+
+
+@dataclass
+class DownloadScheduler:
+    """Decide when the downloads requested from homeservers can start.
+
+    At most `max_downloads` can run at the same time. Of these, at most
+    `max_per_homeserver` can be for the same homeserver, and at most
+    `max_full_downloads` can be `UserDownload` or `Prefetch` downloads,
+    so that big files can't delay thumbnails and avatars.
+
+    When a download ends, the queued one with the most urgent
+    `DownloadPriority` not blocked by these limits is started, in
+    order of request for a same priority.
+    Queued downloads are removed as soon as their requester is cancelled,
+    e.g. when an image scrolled out of view in QML is destroyed.
+
+    The number of queued downloads and the time they wait, a moving
+    average, are available for each priority with `queue_depths` and
+    `wait_times`.
+    """
+
+    max_downloads:      ClassVar[int] = 12
+    max_per_homeserver: ClassVar[int] = 8
+    max_full_downloads: ClassVar[int] = 4
+
+    # {homeserver: running downloads}
+    running:      Dict[str, int] = field(init=False, default_factory=dict)
+    running_full: int            = field(init=False, default=0)
+
+    # {priority: seconds}
+    wait_times: Dict[DownloadPriority, float] = field(
+        init=False, default_factory=dict,
+    )
+
+    max_queue_depth:  int = field(init=False, default=0)
+    cancelled_queued: int = field(init=False, default=0)
+
+    _queue: List[QueuedDownload] = field(
+        init=False, repr=False, default_factory=list,
+    )
+
+    _order: Iterator[int] = field(
+        init=False, repr=False, default_factory=itertools.count,
+    )
+
+
+    @property
+    def queue_depths(self) -> Dict[DownloadPriority, int]:
+        """Number of downloads waiting to start for each priority."""
+
+        depths: Dict[DownloadPriority, int] = {}
+
+        for priority, *_ in self._queue:
+            depths[priority] = depths.get(priority, 0) + 1
+
+        return depths
+
+
+    @asynccontextmanager
+    async def slot(
+        self, homeserver: str, priority: DownloadPriority,
+    ) -> AsyncIterator[None]:
+        """Context manager to wrap a download, waits until it can start."""
+
+        future = asyncio.get_event_loop().create_future()
+        entry  = (priority, next(self._order), homeserver, future)
+        start  = time.monotonic()
+
+        heapq.heappush(self._queue, entry)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._start_next()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():  # we got a slot just before
+                self._release(homeserver, priority)
+                raise
+
+            self.cancelled_queued += 1
+
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            raise
+
+        waited                    = time.monotonic() - start
+        previous                  = self.wait_times.get(priority, waited)
+        self.wait_times[priority] = previous * 0.7 + waited * 0.3
+
+        if waited > 1:
+            log.debug(
+                "%s download from %s waited %.2fs, queued: %r",
+                priority.name, homeserver, waited, self.queue_depths,
+            )
+
+        try:
+            yield
+        finally:
+            self._release(homeserver, priority)
+
+
+    def _start_next(self) -> None:
+        """Let queued downloads start while limits allow it."""
+
+        blocked: List[QueuedDownload] = []
+
+        while self._queue and sum(self.running.values()) < self.max_downloads:
+            entry                           = heapq.heappop(self._queue)
+            priority, _, homeserver, future = entry
+
+            if future.done():  # cancelled
+                continue
+
+            full = priority >= DownloadPriority.UserDownload
+
+            if self.running.get(homeserver, 0) >= self.max_per_homeserver or (
+                full and self.running_full >= self.max_full_downloads
+            ):
+                blocked.append(entry)
+                continue
+
+            self.running[homeserver] = self.running.get(homeserver, 0) + 1
+            self.running_full       += full
+            future.set_result(None)
+
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+
+    def _release(self, homeserver: str, priority: DownloadPriority) -> None:
+        self.running[homeserver] -= 1
+
+        if not self.running[homeserver]:
+            del self.running[homeserver]
+
+        if priority >= DownloadPriority.UserDownload:
+            self.running_full -= 1
+
+        self._start_next()
+
+
+@dataclass
+class InFlightDownloads:
+    """Share running downloads between everything requesting the same file.
+
+    The first `run()` call for a key starts the download in a new task,
+    and later calls for that key wait for the same task's result.
+    Keys are forgotten as soon as their download is done.
+
+    A caller being cancelled doesn't affect the others, the download task
+    is only cancelled if all its callers have been.
+    """
+
+    tasks: Dict[str, asyncio.Future] = field(default_factory=dict)
+
+    # {task: number of callers waiting for it}
+    _waiters: Dict[asyncio.Future, int] = field(
+        default_factory=dict, repr=False,
+    )
+
+
+    async def run(
+        self, key: str, create: Callable[[], Awaitable[Path]],
+    ) -> Path:
+        """Return the result of `create()`, or of the running one for `key`.
+        """
+
+        task = self.tasks.get(key)
+
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(create())
+            self._waiters[task]    = 0
+            task.add_done_callback(functools.partial(self._forget, key))
+
+        self._waiters[task] += 1
+
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self._waiters[task] -= 1
+
+                if not self._waiters[task]:
+                    task.cancel()
+            raise
+
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+
+        self._waiters.pop(task, None)
+
+
+IN_FLIGHT_DOWNLOADS = InFlightDownloads()
+
+
+@dataclass
+class MxcEvents:
+    """Registry of the media `Event` items of all accounts by mxc URI.
+
+    Events are only weakly referenced, and events that were removed from
+    their model are forgotten, so that timelines unloaded from memory
+    aren't kept alive by this registry.
+    """
+
+    # {mxc: events}
+    _events: Dict[str, "weakref.WeakSet[Event]"] = field(
+        default_factory=dict, repr=False,
+    )
+
+
+    def add(self, mxc: str, event: Event) -> None:
+        """Register an event whose media is the passed mxc URI."""
+
+        self._events.setdefault(mxc, weakref.WeakSet()).add(event)
+
+
+    def get(self, mxc: str) -> List[Event]:
+        """Return the registered events that are still in a model for mxc.
+        """
+
+        events = self._events.get(mxc)
+
+        if events is None:
+            return []
+
+        loaded = []
+
+        for event in list(events):
+            model = event.parent_model
+
+            # Replaced items keep the model they were in as parent
+            if model is not None and model.get(event.id) is event:
+                loaded.append(event)
+            else:
+                events.discard(event)
+
+        if not loaded:
+            del self._events[mxc]
+
+        return loaded
+
+
+    def mxcs(self) -> Set[str]:
+        """Return the mxc URIs that have registered events still in a model.
+        """
+
+        return {mxc for mxc in list(self._events) if self.get(mxc)}
+
+
+@dataclass
+class AttachmentDecryptor:
+    """Decrypt an encrypted matrix file piece by piece.
+
+    This is equivalent to `nio.crypto.attachments.decrypt_attachment()`, for
+    files that are too big to be kept in memory. Each piece of encrypted
+    data must be passed in order to `update()`, which returns the decrypted
+    piece. `verify()` must be called after the last piece to check the
+    SHA-256 hash of the whole encrypted file.
+    """
+
+    crypt_dict: Dict[str, Any] = field(repr=False)
+
+    def __post_init__(self) -> None:
+        try:
+            key    = unpaddedbase64.decode_base64(self.crypt_dict["key"]["k"])
+            iv     = unpaddedbase64.decode_base64(self.crypt_dict["iv"])
+            digest = unpaddedbase64.decode_base64(
+                self.crypt_dict["hashes"]["sha256"],
+            )
+        except (binascii.Error, KeyError, TypeError) as err:
+            raise nio.EncryptionError(f"Invalid file info: {err!r}")
+
+        counter = Counter.new(
+            64, prefix=iv[:8], initial_value=int.from_bytes(iv[8:], "big"),
+        )
+
+        try:
+            self._cipher = AES.new(key, AES.MODE_CTR, counter=counter)
+        except ValueError as err:
+            raise nio.EncryptionError(err)
+
+        self._hash          = SHA256.new()
+        self._expected_hash = digest
+
+
+    def update(self, data: bytes) -> bytes:
+        """Return the decrypted version of the next piece of the file."""
+
+        self._hash.update(data)
+        return self._cipher.decrypt(data)
+
+
+    def verify(self) -> None:
+        """Raise `nio.EncryptionError` if the file's hash is wrong."""
+
+        if self._hash.digest() != self._expected_hash:
+            raise nio.EncryptionError("Mismatched SHA-256 digest.")
+
+
 @dataclass
 class Media:
     """A matrix media file that is downloaded or has yet to be.
@@ -77,6 +761,7 @@ class Media:
     room_id:        Optional[str]            = None
     filesize:       Optional[int]            = None
     crypt_dict:     Optional[Dict[str, Any]] = field(default=None, repr=False)
+    priority:       DownloadPriority         = DownloadPriority.UserDownload
 
 
     def __post_init__(self) -> None:
@@ -106,47 +791,71 @@ class Media:
 
 
     async def get(self) -> Path:
-        """Return the cached file's path, downloading it first if needed."""
+        """Return the cached file's path, downloading it first if needed.
 
-        async with ACCESS_LOCKS[self.mxc]:
-            try:
-                return await self.get_local()
-            except FileNotFoundError:
-                return await self.create()
+        If the file is already being downloaded for another request, wait
+        for that download instead of starting a new one.
+        """
+
+        try:
+            path = await self.get_local()
+        except FileNotFoundError:
+            path = await IN_FLIGHT_DOWNLOADS.run(
+                str(self.local_path), self.create,
+            )
+
+        self.cache.accessed(path, self.mxc)
+        return path
 
 
     async def get_local(self) -> Path:
         """Return a cached local existing path for this media or raise."""
 
-        if not self.local_path.exists():
+        path = self.local_path
+
+        if not self.cache.is_cached(path):
             raise FileNotFoundError()
 
-        return self.local_path
+        return path
 
 
     async def create(self) -> Path:
-        """Download and cache the media file to disk."""
+        """Download and cache the media file to disk.
 
-        async with CONCURRENT_DOWNLOADS_LIMIT:
-            data = await self._get_remote_data()
+        The file is written (and decrypted) piece by piece as it is
+        received, so that it never has to be entirely kept in memory.
+        """
 
         self.local_path.parent.mkdir(parents=True, exist_ok=True)
 
-        async with atomic_write(self.local_path, binary=True) as (file, done):
-            await file.write(data)
-            done()
+        async with self._download_slot():
+            async with atomic_write(self.local_path, binary=True) as (
+                file, done,
+            ):
+                await self._download_to(file)
+                done()
 
-        if type(self) is Media:
-            for event in self.cache.backend.mxc_events[self.mxc]:
-                event.media_local_path = self.local_path
+        for event in self.cache.backend.mxc_events.get(self.mxc):
+            event.media_local_path = self.local_path
 
         return self.local_path
 
 
-    async def _get_remote_data(self) -> bytes:
-        """Return the file's data from the matrix server, decrypt if needed."""
+    def _download_slot(self):
+        """Return a `DownloadScheduler.slot()` context for this media."""
 
         client = self.cache.backend.clients[self.client_user_id]
+        return self.cache.downloads.slot(client.homeserver, self.priority)
+
+
+    async def _download_to(self, file) -> None:
+        """Write the file's data from the server, decrypt it if needed."""
+
+        client    = self.cache.backend.clients[self.client_user_id]
+        decryptor = None
+
+        if self.crypt_dict:
+            decryptor = AttachmentDecryptor(self.crypt_dict)
 
         transfer: Optional[Transfer] = None
         model:    Optional[Model]    = None
@@ -166,21 +875,25 @@ class Media:
 
         try:
             parsed = urlparse(self.mxc)
-            resp   = await client.download(
+            chunks = client.download_chunks(
                 server_name = parsed.netloc,
                 media_id    = parsed.path.lstrip("/"),
             )
-        except (nio.TransferCancelledError, asyncio.CancelledError):
+
+            async for chunk in chunks:
+                await file.write(
+                    decryptor.update(chunk) if decryptor else chunk,
+                )
+
+                if transfer:
+                    transfer.transferred += len(chunk)
+
+            if decryptor:
+                decryptor.verify()
+        finally:
             if transfer and model:
                 del model[str(transfer.id)]
                 del client.transfer_tasks[transfer.id]
-            raise
-
-        if transfer and model:
-            del model[str(transfer.id)]
-            del client.transfer_tasks[transfer.id]
-
-        return await self._decrypt(resp.body)
 
 
     async def _decrypt(self, data: bytes) -> bytes:
@@ -223,10 +936,11 @@ class Media:
         )
         media.local_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not media.local_path.exists() or overwrite:
+        if overwrite or not cache.is_cached(media.local_path):
             func = functools.partial(shutil.copy, existing, media.local_path)
             await asyncio.get_event_loop().run_in_executor(None, func)
 
+        cache.accessed(media.local_path, media.mxc)
         return media
 
 
@@ -248,13 +962,14 @@ class Media:
         )
         media.local_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not media.local_path.exists() or overwrite:
+        if overwrite or not cache.is_cached(media.local_path):
             path = media.local_path
 
             async with atomic_write(path, binary=True) as (file, done):
                 await file.write(data)
                 done()
 
+        cache.accessed(media.local_path, media.mxc)
         return media
 
 
@@ -262,7 +977,8 @@ class Media:
 class Thumbnail(Media):
     """A matrix media's thumbnail, which is downloaded or has yet to be."""
 
-    wanted_size: Size = (800, 600)
+    priority:    DownloadPriority = DownloadPriority.VisibleThumbnail
+    wanted_size: Size             = (800, 600)
 
     server_size: Optional[Size] = field(init=False, repr=False, default=None)
 
@@ -318,6 +1034,26 @@ class Thumbnail(Media):
         return self.cache.thumbs_dir / parsed.netloc / size_dir / filename
 
 
+    async def create(self) -> Path:
+        """Download and cache the thumbnail to disk.
+
+        Unlike full media files, thumbnails are small, and where they must
+        be written depends on the size the server returns, so they are
+        entirely downloaded in memory first.
+        """
+
+        async with self._download_slot():
+            data = await self._get_remote_data()
+
+        self.local_path.parent.mkdir(parents=True, exist_ok=True)
+
+        async with atomic_write(self.local_path, binary=True) as (file, done):
+            await file.write(data)
+            done()
+
+        return self.local_path
+
+
     async def get_local(self) -> Path:
         """Return an existing thumbnail path or raise `FileNotFoundError`.
 
@@ -326,22 +1062,23 @@ class Thumbnail(Media):
         smaller thumbnail.
         """
 
-        if self.local_path.exists():
-            return self.local_path
+        path = self.local_path
+
+        if self.cache.is_cached(path):
+            return path
 
-        try_sizes = ((32, 32), (96, 96), (320, 240), (640, 480), (800, 600))
-        parts     = list(self.local_path.parts)
-        size      = self.normalize_size(self.server_size or self.wanted_size)
+        try_sizes  = ((32, 32), (96, 96), (320, 240), (640, 480), (800, 600))
+        server_dir = str(path.parent.parent)
+        size       = self.normalize_size(self.server_size or self.wanted_size)
 
         for width, height in try_sizes:
             if width < size[0] or height < size[1]:
                 continue
 
-            parts[-2] = f"{width}x{height}"
-            path      = Path("/".join(parts))
+            other = os.path.join(server_dir, f"{width}x{height}", path.name)
 
-            if path.exists():
-                return path
+            if self.cache.is_cached(other):
+                return Path(other)
 
         raise FileNotFoundError()
 
@@ -0,0 +1,478 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""On-disk cache of account models, to show them before the first sync."""
+
+import asyncio
+import json
+import logging as log
+import sqlite3
+import traceback
+from collections.abc import Mapping
+from dataclasses import fields
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING, Any, ClassVar, Dict, List, Optional, Set, Tuple, Type,
+    Union,
+)
+
+import nio
+
+from .models import SyncId
+from .models.items import Event, Member, Room
+from .models.model import Model
+from .models.model_item import ModelItem
+from .models.proxy import ModelProxy
+from .pyotherside_events import LoopException
+
+if TYPE_CHECKING:
+    from .models.model_store import ModelStore
+
+# (user_id, room_id, kind, item_id) - room_id is "" for rooms
+RowKey = Tuple[str, str, str, str]
+
+# (user_id, room_id, kind, item_id, date, JSON fields)
+Row = Tuple[str, str, str, str, float, str]
+
+ITEM_TYPES: Dict[str, Type[ModelItem]] = {
+    "rooms": Room, "members": Member, "events": Event,
+}
+
+# Fields that aren't cached and get their default value back when restored
+UNCACHED_FIELDS = {"_sort_overrides"}
+
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    date    REAL NOT NULL,
+    data    TEXT NOT NULL,
+    PRIMARY KEY (user_id, room_id, kind, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS items_by_date ON items (
+    user_id, room_id, kind, date
+);
+"""
+
+
+class ModelCache(ModelProxy):
+    """SQLite cache of the rooms, members and recent events of accounts.
+
+    Changes to `(user_id, "rooms")`, `(user_id, room_id, "members")` and
+    `(user_id, room_id, "events")` models are received like any proxy
+    receives them, but instead of being stored in this model, the changed
+    items are written to the database every `write_interval` seconds.
+    Only the `events_per_room` most recent events of each room are kept,
+    and local echoes are never written.
+    Events of encrypted rooms are never written either, since their
+    decrypted content would be stored in plain text.
+
+    `load()` puts the cached items of an account back into their models,
+    so that they can be shown before the first sync is done.
+    """
+
+    write_interval:  ClassVar[float] = 5
+    events_per_room: ClassVar[int]   = 50
+
+    def __init__(self, models: "ModelStore", path: Path) -> None:
+        self.models = models
+        self.path   = path
+
+        # {sync_id: {key: changed item, or None if it was deleted}}
+        self._pending: Dict[SyncId, Dict[Any, Optional[ModelItem]]] = {}
+
+        # Models cleared since the last write
+        self._pending_clears: Set[SyncId] = set()
+
+        self._restoring:  bool         = False
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+
+        with self._db:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+
+            if version != SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS items")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+            self._db.executescript(SCHEMA)
+
+        super().__init__(sync_id="model_cache")
+
+        self._writer = asyncio.ensure_future(self._start_writer())
+
+
+    def accept_source(self, source: Model) -> bool:
+        return self._cached_sync_id(source) is not None
+
+
+    def source_item_set(
+        self,
+        source: Model,
+        key,
+        value: ModelItem,
+        _changed_fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        sync_id = self._cached_sync_id(source)
+
+        if sync_id and not self._restoring:
+            self._pending.setdefault(sync_id, {})[key] = value
+
+
+    def source_item_deleted(self, source: Model, key) -> None:
+        sync_id = self._cached_sync_id(source)
+
+        if sync_id:
+            self._pending.setdefault(sync_id, {})[key] = None
+
+
+    def source_cleared(self, source: Model) -> None:
+        sync_id = self._cached_sync_id(source)
+
+        if sync_id:
+            self._pending[sync_id] = {}
+            self._pending_clears.add(sync_id)
+
+
+    async def load(self, user_id: str) -> Set[str]:
+        """Put an account's cached items into their models.
+
+        Returns the IDs of the rooms that were restored.
+        Cached members and events are only restored for cached rooms.
+        """
+
+        try:
+            rows = await asyncio.get_event_loop().run_in_executor(
+                None, self._read, user_id,
+            )
+        except sqlite3.Error:
+            trace = traceback.format_exc().rstrip()
+            log.warning("Can't read cached models for %s: %s", user_id, trace)
+            return set()
+
+        ids = set()
+
+        self._restoring = True
+
+        try:
+            for room_id, kind, item_id, data in rows:
+                try:
+                    item = self._deserialized(kind, data)
+                except Exception:  # noqa
+                    trace = traceback.format_exc().rstrip()
+                    log.warning("Ignoring invalid cached item: %s", trace)
+                    continue
+
+                if kind == "rooms":
+                    ids.add(item_id)
+                    model = self.models[user_id, "rooms"]
+                else:
+                    model = self.models[user_id, room_id, kind]
+
+                model.setdefault(item_id, item)
+        finally:
+            self._restoring = False
+
+        return ids
+
+
+    async def flush(self) -> None:
+        """Write the pending changes to the database."""
+
+        async with self._flush_lock:
+            clears, self._pending_clears = self._pending_clears, set()
+            pending, self._pending       = self._pending, {}
+
+            deleted: List[RowKey]           = []
+            rows:    List[Row]              = []
+            prune:   Set[Tuple[str, str]]   = set()  # {(user_id, room_id)}
+
+            for sync_id, items in pending.items():
+                user_id, room_id, kind = self._split_sync_id(sync_id)
+                model                  = self.models.data.get(sync_id)
+                secret                 = kind == "events" and \
+                    self._room_encrypted(user_id, room_id)
+
+                for key, item in items.items():
+                    if item is None:
+                        deleted.append((user_id, room_id, kind, key))
+                        continue
+
+                    if kind == "events" and (
+                        secret or not self._keep_event(model, item)
+                    ):
+                        continue
+
+                    try:
+                        data = self._serialized(item)
+                    except Exception:  # noqa
+                        trace = traceback.format_exc().rstrip()
+                        log.warning("Can't cache %r: %s", item, trace)
+                        continue
+
+                    date = 0.0
+
+                    if isinstance(item, Event):
+                        date = item.date.timestamp()
+
+                    rows.append((user_id, room_id, kind, key, date, data))
+
+                    if kind == "events":
+                        prune.add((user_id, room_id))
+
+            if not (clears or deleted or rows):
+                return
+
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._write, clears, deleted, rows, prune,
+            )
+
+
+    async def _start_writer(self) -> None:
+        """Disk writer coroutine, flush changes every `write_interval`."""
+
+        while True:
+            await asyncio.sleep(self.write_interval)
+
+            try:
+                await self.flush()
+            except Exception as err:  # noqa
+                LoopException(str(err), err, traceback.format_exc().rstrip())
+
+
+    @staticmethod
+    def _cached_sync_id(source: Model) -> Optional[SyncId]:
+        """Return the `sync_id` of a model whose items are cached, or None.
+        """
+
+        sync_id = source.sync_id
+
+        if not isinstance(sync_id, tuple):
+            return None
+
+        if (len(sync_id) == 2 and sync_id[1] == "rooms") or (
+            len(sync_id) == 3 and sync_id[2] in ("members", "events")
+        ):
+            return sync_id
+
+        return None
+
+
+    def _room_encrypted(self, user_id: str, room_id: str) -> bool:
+        """Return whether a room is, or could be, an encrypted one."""
+
+        rooms = self.models.data.get((user_id, "rooms"))
+        room  = rooms.get(room_id) if rooms is not None else None
+        return not isinstance(room, Room) or room.encrypted
+
+
+    def _keep_event(self, model: Optional[Model], event: ModelItem) -> bool:
+        """Return whether an event is recent enough to be cached."""
+
+        assert isinstance(event, Event)  # nosec
+
+        if event.is_local_echo or model is None:
+            return False
+
+        try:
+            return model._sorted_data.index(event) < self.events_per_room
+        except ValueError:  # Replaced or removed since it was changed
+            return False
+
+
+    @staticmethod
+    def _split_sync_id(sync_id: SyncId) -> Tuple[str, str, str]:
+        """Return the user ID, room ID and kind of items for a model."""
+
+        if len(sync_id) == 2:
+            return (sync_id[0], "", "rooms")
+
+        return sync_id  # type: ignore
+
+
+    @classmethod
+    def _serialized(cls, item: ModelItem) -> str:
+        """Return an item's fields as JSON, see `_json_value()`."""
+
+        values = {
+            f.name: cls._json_value(getattr(item, f.name))
+            for f in fields(item) if f.name not in UNCACHED_FIELDS
+        }
+
+        if isinstance(item, Event):
+            # JSON that compacted events keep, no need to parse it again
+            values["source"] = item.serialized_field("source")
+
+        return json.dumps(values)
+
+
+    @classmethod
+    def _deserialized(cls, kind: str, data: str) -> ModelItem:
+        """Return an item from `_serialized()` JSON."""
+
+        item_type = ITEM_TYPES[kind]
+        values    = json.loads(data)
+        source    = values.pop("source", None)
+        item      = item_type(**{
+            f.name: cls._field_value(f.type, values[f.name])
+            for f in fields(item_type)
+            if f.init and f.name in values and f.name not in UNCACHED_FIELDS
+        })
+
+        # Nobody can still be typing since the data was cached
+        if isinstance(item, Room):
+            item.typing_members = []
+        elif isinstance(item, Member):
+            item.typing = False
+
+        # Restored events start compacted, `nio_source` parses the JSON
+        if isinstance(item, Event):
+            item.__dict__["_compacted_source"] = source
+
+        return item
+
+
+    @classmethod
+    def _json_value(cls, value: Any) -> Any:
+        """Convert a field value to something that can be dumped as JSON.
+
+        Dates become timestamps, enums their value, paths strings and
+        classes (i.e. `Event.event_type`) their name.
+        """
+
+        if isinstance(value, datetime):
+            return value.timestamp()
+
+        if isinstance(value, Enum):
+            return value.value
+
+        if isinstance(value, Path):
+            return str(value)
+
+        if isinstance(value, type):
+            return value.__name__
+
+        if isinstance(value, Mapping):
+            return {k: cls._json_value(v) for k, v in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            return [cls._json_value(v) for v in value]
+
+        return value
+
+
+    @staticmethod
+    def _field_value(field_type: Any, value: Any) -> Any:
+        """Convert back a `_json_value()` for a field of type `field_type`.
+        """
+
+        origin = getattr(field_type, "__origin__", None)
+        args   = getattr(field_type, "__args__", ())
+
+        if field_type is datetime:
+            return datetime.fromtimestamp(value)
+
+        if isinstance(field_type, type) and issubclass(field_type, Enum):
+            return field_type(value)
+
+        if origin is type:
+            event_type = getattr(nio, value, None)
+            known      = (nio.Event, nio.events.misc.BadEvent)
+
+            if not (isinstance(event_type, type) and
+                    issubclass(event_type, known)):
+                raise ValueError(f"Unknown event type: {value}")
+
+            return event_type
+
+        if origin is Union and Path in args:
+            return Path(value) if value else value
+
+        if origin is list and args and \
+           getattr(args[0], "__origin__", None) is tuple:
+            return [tuple(v) for v in value]
+
+        return value
+
+
+    def _read(self, user_id: str) -> List[Tuple[str, str, str, str]]:
+        """Return the `(room_id, kind, item_id, data)` rows for an account.
+        """
+
+        return self._db.execute(
+            "SELECT room_id, kind, item_id, data FROM items "
+            "WHERE user_id = ? AND ("
+            "    kind = 'rooms' OR room_id IN ("
+            "        SELECT item_id FROM items "
+            "        WHERE user_id = ? AND kind = 'rooms'"
+            "    )"
+            ")",
+            (user_id, user_id),
+        ).fetchall()
+
+
+    def _write(
+        self,
+        clears:  Set[SyncId],
+        deleted: List[RowKey],
+        rows:    List[Row],
+        prune:   Set[Tuple[str, str]],
+    ) -> None:
+        """Apply changes to the database, meant to run in a thread."""
+
+        with self._db:
+            for sync_id in clears:
+                user_id, room_id, kind = self._split_sync_id(sync_id)
+
+                if kind == "rooms":
+                    # Rooms are only cleared when the account is logged out
+                    self._db.execute(
+                        "DELETE FROM items WHERE user_id = ?", (user_id,),
+                    )
+                else:
+                    self._db.execute(
+                        "DELETE FROM items "
+                        "WHERE user_id = ? AND room_id = ? AND kind = ?",
+                        (user_id, room_id, kind),
+                    )
+
+            self._db.executemany(
+                "DELETE FROM items "
+                "WHERE user_id = ? AND room_id = ? AND kind = ? "
+                "AND item_id = ?",
+                deleted,
+            )
+
+            # A room's members and events go with it
+            self._db.executemany(
+                "DELETE FROM items WHERE user_id = ? AND room_id = ?",
+                [(key[0], key[3]) for key in deleted if key[2] == "rooms"],
+            )
+
+            self._db.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+            self._db.executemany(
+                "DELETE FROM items "
+                "WHERE user_id = ? AND room_id = ? AND kind = 'events' "
+                "AND item_id NOT IN ("
+                "    SELECT item_id FROM items "
+                "    WHERE user_id = ? AND room_id = ? AND kind = 'events' "
+                "    ORDER BY date DESC LIMIT ?"
+                ")",
+                [
+                    (user_id, room_id, user_id, room_id, self.events_per_room)
+                    for user_id, room_id in prune
+                ],
+            )
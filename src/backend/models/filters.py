@@ -2,7 +2,8 @@
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
 from typing import (
-    TYPE_CHECKING, Any, Callable, Collection, Dict, List, Optional, Tuple,
+    TYPE_CHECKING, Any, Callable, ClassVar, Collection, Dict, List, Optional,
+    Set, Tuple,
 )
 
 from . import SyncId
@@ -12,12 +13,114 @@ from .proxy import ModelProxy
 if TYPE_CHECKING:
     from .model_item import ModelItem
 
+FilterKey = Tuple[Optional[SyncId], str]
+
+
+class SearchIndex:
+    """Index of texts by their trigrams, to find which ones contain a word.
+
+    This is used to quickly find which items of a model might match a
+    filter, instead of trying every item. Words longer than three characters
+    are looked up through all their trigrams, so `search()` can return false
+    positives, which must be checked.
+
+    Texts are padded with two null characters before being split into
+    trigrams, so that shorter words can be looked up too, through the
+    trigrams they start.
+    """
+
+    def __init__(self) -> None:
+        self.texts:    Dict[Any, str]      = {}
+        self.trigrams: Dict[str, Set[Any]] = {}
+
+        # {1 or 2 characters: {trigrams starting with these characters}}
+        self.prefixes: Dict[str, Set[str]] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+    def set(self, key, text: str) -> None:
+        """Index or reindex the text for `key`."""
+
+        if self.texts.get(key) == text:
+            return
+
+        self.remove(key)
+        self.texts[key] = text
+
+        for trigram in self._trigrams(text):
+            if trigram not in self.trigrams:
+                self.trigrams[trigram] = set()
+
+                for prefix in (trigram[0], trigram[:2]):
+                    self.prefixes.setdefault(prefix, set()).add(trigram)
+
+            self.trigrams[trigram].add(key)
+
+
+    def remove(self, key) -> None:
+        """Forget the text for `key`, if it was indexed."""
+
+        text = self.texts.pop(key, None)
+
+        if text is None:
+            return
+
+        for trigram in self._trigrams(text):
+            keys = self.trigrams[trigram]
+            keys.discard(key)
+
+            if keys:
+                continue
+
+            del self.trigrams[trigram]
+
+            for prefix in (trigram[0], trigram[:2]):
+                self.prefixes[prefix].discard(trigram)
+
+                if not self.prefixes[prefix]:
+                    del self.prefixes[prefix]
+
+
+    def search(self, words: Collection[str]) -> Optional[Set[Any]]:
+        """Return keys whose text may contain all the passed words.
+
+        `None` is returned if no word can be used to restrict the results.
+        """
+
+        sets: List[Set[str]] = []
+
+        for word in words:
+            if len(word) < 3:
+                trigrams = self.prefixes.get(word, ())
+                sets.append(set().union(*(self.trigrams[t] for t in trigrams)))
+                continue
+
+            sets += [
+                self.trigrams.get(word[i:i + 3], set())
+                for i in range(len(word) - 2)
+            ]
+
+        if not sets:
+            return None
+
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        text = f"{text}\0\0"
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
 
 class ModelFilter(ModelProxy):
     """Filter data from one or more source models."""
 
     def __init__(self, sync_id: SyncId) -> None:
-        self.filtered_out: Dict[Tuple[Optional[SyncId], str], "ModelItem"] = {}
+        self.filtered_out: Dict[FilterKey, "ModelItem"] = {}
         self.items_changed_callbacks: List[Callable[[], None]] = []
         super().__init__(sync_id)
 
@@ -79,28 +182,72 @@ class ModelFilter(ModelProxy):
 
     def refilter(
         self,
-        only_if: Optional[Callable[["ModelItem"], bool]] = None,
+        only_if:              Optional[Callable[["ModelItem"], bool]] = None,
+        recheck_shown:        bool = True,
+        recheck_filtered_out: bool = True,
     ) -> None:
-        """Recheck every item to decide if they should be filtered out."""
+        """Recheck every item to decide if they should be filtered out.
+
+        If `recheck_shown` is `False`, currently shown items are assumed to
+        still be accepted. If `recheck_filtered_out` is `False`, filtered out
+        items are assumed to still be rejected.
+        """
 
         with self.write_lock:
             take_out   = []
             bring_back = []
 
-            for key, item in sorted(self.items(), key=lambda kv: kv[1]):
-                if only_if and not only_if(item):
-                    continue
+            if recheck_shown:
+                keys = {id(item): key for key, item in self.items()}
+
+                for item in self._sorted_data:
+                    if only_if and not only_if(item):
+                        continue
+
+                    if not self.accept_item(item):
+                        take_out.append(keys[id(item)])
 
-                if not self.accept_item(item):
-                    take_out.append(key)
+            if recheck_filtered_out:
+                for key, item in self.filtered_out.items():
+                    if only_if and not only_if(item):
+                        continue
 
-            for key, item in self.filtered_out.items():
-                if only_if and not only_if(item):
-                    continue
+                    if self.accept_item(item):
+                        bring_back.append(key)
 
-                if self.accept_item(item):
-                    bring_back.append(key)
+            self._move_items(take_out, bring_back)
+
+
+    def _show_only(self, keys: Collection[FilterKey]) -> None:
+        """Filter out every item, except those with the passed keys.
+
+        The model's items are replaced at once with `Model.reset()`, which
+        is faster than `_move_items()` when most shown items must be
+        filtered out, as only the items kept need to be handled one by one.
+        """
+
+        with self.write_lock:
+            shown = {
+                key: self.get(key) or self.filtered_out[key] for key in keys
+            }
+
+            self.filtered_out.update(self._data)
+
+            for key in shown:
+                del self.filtered_out[key]
+
+            self.reset(shown)
+
+            for callback in self.items_changed_callbacks:
+                callback()
+
+
+    def _move_items(
+        self, take_out: List[FilterKey], bring_back: List[FilterKey],
+    ) -> None:
+        """Filter out and bring back items with the passed keys."""
 
+        with self.write_lock:
             with self.batch_remove():
                 for key in take_out:
                     self.filtered_out[key] = self.pop(key)
@@ -122,19 +269,34 @@ class FieldStringFilter(ModelFilter):
 
     Matching is done using "smart case": insensitive if the filter text is
     all lowercase, sensitive otherwise.
+
+    If `indexed` is `True`, a `SearchIndex` of the source items' fields is
+    maintained once there are at least `index_min_items` of them, and used
+    when the filter changes to only check the items that can possibly match.
+    This is meant for models that can contain a very large number of items,
+    such as room members. The fields must exist on the source items, and
+    have the same values on items returned by `convert_item()`.
     """
 
+    # Below this number of items, checking all of them is fast enough and
+    # the index isn't worth its memory. Once built, the index is dropped
+    # if the number of items falls under half of this.
+    index_min_items: ClassVar[int] = 2000
+
     def __init__(
         self,
         sync_id:                    SyncId,
         fields:                     Collection[str],
         no_filter_accept_all_items: bool = True,
+        indexed:                    bool = False,
     ) -> None:
 
         self.fields                     = fields
         self.no_filter_accept_all_items = no_filter_accept_all_items
+        self.indexed                    = indexed
         self._filter: str               = ""
 
+        self.search_index: Optional[SearchIndex] = None
 
         super().__init__(sync_id)
 
@@ -146,23 +308,140 @@ class FieldStringFilter(ModelFilter):
 
     @filter.setter
     def filter(self, value: str) -> None:
-        if value != self._filter:
-            self._filter = value
+        if value == self._filter:
+            return
+
+        previous     = self._filter
+        self._filter = value
+
+        # Matching is monotonic as long as a filter is set: when the text is
+        # extended, only shown items can disappear, and when it is shortened,
+        # only filtered out items can come back.
+        if previous and value.startswith(previous):
+            self.refilter(recheck_filtered_out=False)
+        elif value and previous.startswith(value):
+            self.refilter(recheck_shown=False)
+        else:
             self.refilter()
 
 
+    def source_item_set(
+        self,
+        source: Model,
+        key,
+        value: "ModelItem",
+        _changed_fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        with self.write_lock:
+            if self.search_index is not None and self.accept_source(source):
+                text = self._index_text(value)
+                self.search_index.set((source.sync_id, key), text)
+
+            super().source_item_set(source, key, value, _changed_fields)
+            self._update_search_index()
+
+
+    def source_item_deleted(self, source: Model, key) -> None:
+        with self.write_lock:
+            if self.search_index is not None and self.accept_source(source):
+                self.search_index.remove((source.sync_id, key))
+
+            super().source_item_deleted(source, key)
+            self._update_search_index()
+
+
+    def source_cleared(self, source: Model) -> None:
+        with self.write_lock:
+            if self.search_index is not None and self.accept_source(source):
+                for key in tuple(self.search_index.texts):
+                    if key[0] == source.sync_id:
+                        self.search_index.remove(key)
+
+            super().source_cleared(source)
+            self._update_search_index()
+
+
+    def refilter(
+        self,
+        only_if:              Optional[Callable[["ModelItem"], bool]] = None,
+        recheck_shown:        bool = True,
+        recheck_filtered_out: bool = True,
+    ) -> None:
+        with self.write_lock:
+            candidates = None
+
+            if self.search_index is not None and self.filter and not only_if:
+                words      = self.search_words(self.filter.lower())
+                candidates = self.search_index.search(words)
+
+            if candidates is None:
+                super().refilter(only_if, recheck_shown, recheck_filtered_out)
+                return
+
+            # Only candidates can be accepted, other items can be filtered
+            # out without having to check them
+
+            accepted = {
+                key for key in candidates
+                if self.accept_item(self.get(key) or self.filtered_out[key])
+            }
+
+            # When the filter is extended, the shown items are the previous
+            # matches; otherwise, the filter was likely just set and most
+            # shown items must go, which is faster to do all at once.
+            if recheck_shown and len(accepted) < len(self) // 2:
+                self._show_only(accepted)
+                return
+
+            take_out   = [] if not recheck_shown else [
+                key for key in self if key not in accepted
+            ]
+            bring_back = [] if not recheck_filtered_out else [
+                key for key in accepted if key in self.filtered_out
+            ]
+
+            self._move_items(take_out, bring_back)
+
+
+    def _index_text(self, item: "ModelItem") -> str:
+        return " ".join(item.lowercase_field(f) for f in self.fields)
+
+
+    def _update_search_index(self) -> None:
+        """Build or drop the search index depending on the items count."""
+
+        if not self.indexed:
+            return
+
+        count = len(self) + len(self.filtered_out)
+
+        if self.search_index is None and count >= self.index_min_items:
+            self.search_index = SearchIndex()
+
+            for items in (self, self.filtered_out):
+                for key, item in items.items():
+                    self.search_index.set(key, self._index_text(item))
+
+        elif self.search_index and count < self.index_min_items // 2:
+            self.search_index = None
+
+
+    def search_words(self, filtr: str) -> List[str]:
+        """Return the substrings that matching items must contain."""
+        return [filtr]
+
+
     def accept_item(self, item: "ModelItem") -> bool:
         if not self.filter:
             return self.no_filter_accept_all_items
 
-        fields    = {f: getattr(item, f) for f in self.fields}
-        filtr     = self.filter
-        lowercase = filtr.lower()
+        filtr = self.filter
 
-        if lowercase == filtr:
+        if filtr == filtr.lower():
             # Consider case only if filter isn't all lowercase
-            filtr        = lowercase
-            fields = {name: value.lower() for name, value in fields.items()}
+            fields = {f: item.lowercase_field(f) for f in self.fields}
+        else:
+            fields = {f: getattr(item, f) for f in self.fields}
 
         return self.match(fields, filtr)
 
@@ -184,6 +463,10 @@ class FieldSubstringFilter(FieldStringFilter):
     but not just "red" or "light" by themselves.
     """
 
+    def search_words(self, filtr: str) -> List[str]:
+        return filtr.split()
+
+
     def match(self, fields: Dict[str, str], filtr: str) -> bool:
         text = " ".join(fields.values())
 
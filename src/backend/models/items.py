@@ -4,15 +4,22 @@
 """`ModelItem` subclasses definitions."""
 
 import json
-from dataclasses import asdict, dataclass, field
+import sys
+from dataclasses import asdict, dataclass, field, fields
 from datetime import datetime, timedelta
+from functools import total_ordering
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union
+from types import MappingProxyType
+from typing import (
+    Any, ClassVar, Dict, FrozenSet, List, Mapping, Optional, Set, Tuple, Type,
+    Union,
+)
 from uuid import UUID
 
 import lxml  # nosec
 import nio
 
+from ..presence import ORDER as PRESENCE_ORDER
 from ..presence import Presence
 from ..utils import AutoStrEnum, auto, strip_html_tags
 from .model_item import ModelItem
@@ -21,6 +28,31 @@ OptionalExceptionType = Union[Type[None], Type[Exception]]
 
 ZERO_DATE = datetime.fromtimestamp(0)
 
+# Shared by compacted events, immutable so they can't be changed in place
+EMPTY_LIST: Tuple[Any, ...]   = ()
+EMPTY_DICT: Mapping[str, Any] = MappingProxyType({})
+
+
+def desc_date(date: datetime) -> float:
+    """Return a sort key value that orders dates from newest to oldest."""
+    return -(date - ZERO_DATE).total_seconds()
+
+
+@total_ordering
+class Descending:
+    """Wrap a value to invert its ordering inside a sort key."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
+    def __eq__(self, other: Any) -> bool:
+        return self.value == other.value
+
+    def __lt__(self, other: "Descending") -> bool:
+        return other.value < self.value
+
 
 class TypeSpecifier(AutoStrEnum):
     """Enum providing clarification of purpose for some matrix events."""
@@ -61,8 +93,10 @@ class Homeserver(ModelItem):
     stability:      float       = -1
     downtimes_ms:   List[float] = field(default_factory=list)
 
-    def __lt__(self, other: "Homeserver") -> bool:
-        return (self.name.lower(), self.id) < (other.name.lower(), other.id)
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"name", "id"})
+
+    def compute_sort_key(self) -> Tuple:
+        return (self.name.lower(), self.id)
 
 
 @dataclass(eq=False)
@@ -90,8 +124,10 @@ class Account(ModelItem):
     last_active_at:   datetime       = ZERO_DATE
     status_msg:       str            = ""
 
-    def __lt__(self, other: "Account") -> bool:
-        return (self.order, self.id) < (other.order, other.id)
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"order", "id"})
+
+    def compute_sort_key(self) -> Tuple:
+        return (self.order, self.id)
 
 
 @dataclass(eq=False)
@@ -113,7 +149,9 @@ class PushRule(ModelItem):
     sound:        str                  = ""  # usually "default" when set
     urgency_hint: bool                 = False
 
-    def __lt__(self, other: "PushRule") -> bool:
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"kind", "order", "id"})
+
+    def compute_sort_key(self) -> Tuple:
         return (
             self.kind is nio.PushRuleKind.underride,
             self.kind is nio.PushRuleKind.sender,
@@ -122,14 +160,6 @@ class PushRule(ModelItem):
             self.kind is nio.PushRuleKind.override,
             self.order,
             self.id,
-        ) < (
-            other.kind is nio.PushRuleKind.underride,
-            other.kind is nio.PushRuleKind.sender,
-            other.kind is nio.PushRuleKind.room,
-            other.kind is nio.PushRuleKind.content,
-            other.kind is nio.PushRuleKind.override,
-            other.order,
-            other.id,
         )
 
 
@@ -185,42 +215,40 @@ class Room(ModelItem):
     pinned:          bool = False
 
     # Allowed keys: "last_event_date", "unreads", "highlights", "local_unreads"
-    # Keys in this dict will override their corresponding item fields for the
-    # __lt__ method. This is used when we want to lock a room's position,
-    # e.g. to avoid having the room move around when it is focused in the GUI
+    # Keys in this dict will override their corresponding item fields in
+    # compute_sort_key(). This is used when we want to lock a room's position,
+    # e.g. to avoid having the room move around when it is focused in the GUI.
+    # After changing it in place, call notify_change("_sort_overrides") so
+    # that the cached sort key is computed again.
     _sort_overrides: Dict[str, Any] = field(default_factory=dict)
 
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({
+        "id", "for_account", "display_name", "inviter_id", "left",
+        "last_event_date", "unreads", "highlights", "local_unreads",
+        "lexical_sorting", "pinned", "_sort_overrides",
+    })
+
     def _sorting(self, key: str) -> Any:
         return self._sort_overrides.get(key, getattr(self, key))
 
-    def __lt__(self, other: "Room") -> bool:
+    def _room_sort_key(self) -> Tuple:
         by_activity = not self.lexical_sorting
 
         return (
-            self.for_account,
-            other.pinned,
+            not self.pinned,
             self.left,  # Left rooms may have an inviter_id, check them first
-            bool(other.inviter_id),
-            bool(by_activity and other._sorting("highlights")),
-            bool(by_activity and other._sorting("unreads")),
-            bool(by_activity and other._sorting("local_unreads")),
-            other._sorting("last_event_date") if by_activity else ZERO_DATE,
+            not self.inviter_id,
+            not (by_activity and self._sorting("highlights")),
+            not (by_activity and self._sorting("unreads")),
+            not (by_activity and self._sorting("local_unreads")),
+            desc_date(self._sorting("last_event_date")) if by_activity else 0,
             (self.display_name or self.id).lower(),
             self.id,
-
-        ) < (
-            other.for_account,
-            self.pinned,
-            other.left,
-            bool(self.inviter_id),
-            bool(by_activity and self._sorting("highlights")),
-            bool(by_activity and self._sorting("unreads")),
-            bool(by_activity and self._sorting("local_unreads")),
-            self._sorting("last_event_date") if by_activity else ZERO_DATE,
-            (other.display_name or other.id).lower(),
-            other.id,
         )
 
+    def compute_sort_key(self) -> Tuple:
+        return (self.for_account, *self._room_sort_key())
+
 
 @dataclass(eq=False)
 class AccountOrRoom(Account, Room):
@@ -233,36 +261,15 @@ class AccountOrRoom(Account, Room):
     type:          Union[Type[Account], Type[Room]] = Account
     account_order: int                              = -1
 
-    def __lt__(self, other: "AccountOrRoom") -> bool:  # type: ignore
-        by_activity = not self.lexical_sorting
+    sort_fields: ClassVar[FrozenSet[str]] = \
+        Room.sort_fields | {"type", "account_order"}
 
+    def compute_sort_key(self) -> Tuple:
         return (
             self.account_order,
             self.id if self.type is Account else self.for_account,
-            other.type is Account,
-            other.pinned,
-            self.left,
-            bool(other.inviter_id),
-            bool(by_activity and other._sorting("highlights")),
-            bool(by_activity and other._sorting("unreads")),
-            bool(by_activity and other._sorting("local_unreads")),
-            other._sorting("last_event_date") if by_activity else ZERO_DATE,
-            (self.display_name or self.id).lower(),
-            self.id,
-
-        ) < (
-            other.account_order,
-            other.id if other.type is Account else other.for_account,
-            self.type is Account,
-            self.pinned,
-            other.left,
-            bool(self.inviter_id),
-            bool(by_activity and self._sorting("highlights")),
-            bool(by_activity and self._sorting("unreads")),
-            bool(by_activity and self._sorting("local_unreads")),
-            self._sorting("last_event_date") if by_activity else ZERO_DATE,
-            (other.display_name or other.id).lower(),
-            other.id,
+            self.type is not Account,
+            *self._room_sort_key(),
         )
 
 
@@ -285,21 +292,20 @@ class Member(ModelItem):
     last_active_at:   datetime       = ZERO_DATE
     status_msg:       str            = ""
 
-    def __lt__(self, other: "Member") -> bool:
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({
+        "id", "invited", "power_level", "ignored", "presence", "display_name",
+    })
+
+    def compute_sort_key(self) -> Tuple:
+        presence = Presence.State.offline if self.ignored else self.presence
+
         return (
             self.invited,
-            other.power_level,
+            -self.power_level,
             self.ignored,
-            Presence.State.offline if self.ignored else self.presence,
+            PRESENCE_ORDER[presence.value],
             (self.display_name or self.id[1:]).lower(),
             self.id,
-        ) < (
-            other.invited,
-            self.power_level,
-            other.ignored,
-            Presence.State.offline if other.ignored else other.presence,
-            (other.display_name or other.id[1:]).lower(),
-            other.id,
         )
 
 
@@ -333,8 +339,10 @@ class Transfer(ModelItem):
     start_date: datetime = field(init=False, default_factory=datetime.now)
 
 
-    def __lt__(self, other: "Transfer") -> bool:
-        return (self.start_date, self.id) > (other.start_date, other.id)
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"start_date", "id"})
+
+    def compute_sort_key(self) -> Tuple:
+        return (desc_date(self.start_date), Descending(self.id))
 
 
 @dataclass(eq=False)
@@ -388,18 +396,107 @@ class Event(ModelItem):
     thumbnail_height:     int            = 0
     thumbnail_crypt_dict: Dict[str, Any] = field(default_factory=dict)
 
-    def __lt__(self, other: "Event") -> bool:
-        return (self.date, self.id) > (other.date, other.id)
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"date", "id"})
+
+    # Fields shared by many events, interned by compact()
+    interned_fields = (
+        "sender_id", "sender_name", "sender_avatar", "target_id",
+        "target_name", "target_avatar", "redacter_id", "redacter_name",
+        "media_mime", "thumbnail_mime",
+    )
+
+    # Fields replaced by a shared empty list or dict by compact() when empty
+    container_fields = (
+        "links", "mentions", "last_read_by", "media_crypt_dict",
+        "thumbnail_crypt_dict",
+    )
+
+    def compute_sort_key(self) -> Tuple:
+        return (desc_date(self.date), Descending(self.id))
 
     @property
     def plain_content(self) -> str:
         """Plaintext version of the event's content."""
 
-        if isinstance(self.source, nio.RoomMessageText):
-            return self.source.body
+        source = self.nio_source
+
+        if isinstance(source, nio.RoomMessageText):
+            return source.body
 
         return strip_html_tags(self.content)
 
+    @property
+    def compacted(self) -> bool:
+        """Whether `compact()` dropped this event's `source`."""
+        return "_compacted_source" in self.__dict__
+
+    @property
+    def nio_source(self) -> Optional[nio.Event]:
+        """The `source` field, parsed again if `compact()` dropped it.
+
+        The parsed event is kept as `source` until the next compaction.
+        Python code needing the `nio.Event` should use this instead of
+        `source`, which is `None` for compacted events.
+        """
+
+        if not self.compacted:
+            return self.source
+
+        values = json.loads(self.__dict__.pop("_compacted_source"))
+
+        if not values:
+            return None
+
+        try:
+            source = self.event_type.from_dict(values["source"])
+        except Exception:  # noqa
+            source = nio.Event.parse_event(values["source"])
+
+        # Restore attributes not coming from the raw event, e.g. `decrypted`
+        for name, value in values.items():
+            if name != "source" and hasattr(source, name) and (
+                value is None or isinstance(value, (bool, int, float, str))
+            ):
+                setattr(source, name, value)
+
+        self.__dict__["source"] = source
+        return source
+
+    def compact(self) -> bool:
+        """Reduce the memory used by this event while it isn't shown.
+
+        Commonly repeated strings like sender IDs are interned, empty
+        containers are replaced by shared ones, cached serialized fields
+        are forgotten and `source` is dropped, only keeping its
+        serialized form.
+
+        The change isn't visible to QML and `nio_source` can bring back the
+        `nio.Event`, so this can be called on any event.
+        Returns whether anything was done: local echoes and already
+        compacted events are left as is.
+        """
+
+        if self.is_local_echo or self.compacted:
+            return False
+
+        values = self.__dict__
+
+        for name in self.interned_fields:
+            values[name] = sys.intern(values[name])
+
+        for name in self.container_fields:
+            if not values[name]:
+                is_dict      = isinstance(values[name], dict)
+                values[name] = EMPTY_DICT if is_dict else EMPTY_LIST
+
+        values["_compacted_source"] = self.serialized_field("source")
+        values["source"]            = None
+
+        # Cheap to compute again if QML needs them, unlike the source
+        values.pop("_serialized_cache", None)
+        values.pop("_lowercase_cache", None)
+        return True
+
     @staticmethod
     def parse_links(text: str) -> List[str]:
         """Return list of URLs (`<a href=...>` tags) present in the content."""
@@ -429,9 +526,24 @@ class Event(ModelItem):
             if lxml.etree.tostring(el) not in ignore
         ]
 
-    def serialized_field(self, field: str) -> Any:
+    def _invalidate_caches(self, changed) -> None:
+        if "source" in changed:
+            self.__dict__.pop("_compacted_source", None)
+
+        super()._invalidate_caches(changed)
+
+    def _serialize_field(self, field: str) -> Any:
         if field == "source":
-            source_dict = asdict(self.source) if self.source else {}
-            return json.dumps(source_dict)
+            if self.compacted:
+                return self.__dict__["_compacted_source"]
+
+            if not self.source:
+                return "{}"
+
+            # Equivalent to dumping asdict(self.source), without deep-copying
+            # the whole event first
+            source = self.source
+            values = {f.name: getattr(source, f.name) for f in fields(source)}
+            return json.dumps(values, default=asdict)
 
-        return super().serialized_field(field)
+        return super()._serialize_field(field)
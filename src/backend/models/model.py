@@ -1,16 +1,22 @@
 # Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import asyncio
 import itertools
 from contextlib import contextmanager
-from threading import RLock
+from dataclasses import replace
+from operator import attrgetter
+from threading import Lock, RLock
 from typing import (
-    TYPE_CHECKING, Any, Dict, Iterator, List, MutableMapping, Optional, Tuple,
+    TYPE_CHECKING, Any, ClassVar, Dict, Iterator, List, MutableMapping,
+    Optional, Tuple, Type, TypeVar, cast,
 )
 
-from sortedcontainers import SortedList
+from sortedcontainers import SortedKeyList
 
-from ..pyotherside_events import ModelCleared, ModelItemDeleted, ModelItemSet
+from ..pyotherside_events import (
+    ModelBatchChanged, ModelCleared, ModelItemDeleted, ModelItemSet,
+)
 from ..utils import serialize_value_for_qml
 from . import SyncId
 
@@ -18,6 +24,8 @@ if TYPE_CHECKING:
     from .model_item import ModelItem
     from .proxy import ModelProxy  # noqa
 
+ItemT = TypeVar("ItemT", bound="ModelItem")
+
 
 class Model(MutableMapping):
     """A mapping of `{ModelItem.id: ModelItem}` synced between Python & QML.
@@ -30,27 +38,69 @@ class Model(MutableMapping):
     model is cleared, corresponding `PyOtherSideEvent` are fired to inform
     QML of the changes so that it can keep its models in sync.
 
-    Items in the model are kept sorted using the `ModelItem` subclass `__lt__`.
+    Items in the model are kept sorted using the `ModelItem.sort_key` of the
+    subclass, which is cached by items until a field it depends on changes.
+
+    If `Model.batch_window` is more than 0, changes aren't sent to QML
+    immediately: they are accumulated for that number of seconds, then sent
+    as a single `ModelBatchChanged` event per model. Insertions, moves and
+    removals are recorded as they happen, while repeated field changes to
+    the same item are merged and sent once at the item's final position.
+    Pending changes are always flushed before any non-model
+    `PyOtherSideEvent` is sent, so that QML never receives e.g. a
+    `CoroutineDone` before the model changes that coroutine made.
     """
 
     instances: Dict[SyncId, "Model"]      = {}
     proxies:   Dict[SyncId, "ModelProxy"] = {}
 
+    # Number of times a change wasn't dispatched to a proxy, because it
+    # isn't subscribed to the model the change happened in
+    avoided_proxy_dispatches: ClassVar[int] = 0
+
+    # Seconds during which changes are accumulated before being sent to QML,
+    # 0 to send every change immediately. The default is about one frame.
+    batch_window: ClassVar[float] = 0.016
+
+    # Loop in which batches are flushed, set by the `QMLBridge`.
+    # If unset, the loop running in the current thread is used, if any.
+    event_loop: ClassVar[Optional[asyncio.AbstractEventLoop]] = None
+
+    pending_batches: ClassVar[Dict[SyncId, "Model"]] = {}
+    _pending_lock:   ClassVar[Lock]                  = Lock()
+    _flush_planned:  ClassVar[bool]                  = False
+
 
     def __init__(self, sync_id: Optional[SyncId]) -> None:
-        self.sync_id:      Optional[SyncId]        = sync_id
-        self.write_lock:   RLock                   = RLock()
-        self._data:        Dict[Any, "ModelItem"]  = {}
-        self._sorted_data: SortedList["ModelItem"] = SortedList()
+        self.sync_id:      Optional[SyncId]           = sync_id
+        self.write_lock:   RLock                      = RLock()
+        self._data:        Dict[Any, "ModelItem"]     = {}
+        self._sorted_data: SortedKeyList["ModelItem"] = \
+            SortedKeyList(key=attrgetter("sort_key"))
 
         self.take_items_ownership: bool = True
 
+        # Proxies for which accept_source(self) is True, see ModelProxy
+        self.subscribed_proxies: List["ModelProxy"] = []
+
         # [(index, item.id), ...]
         self._active_batch_removed: Optional[List[Tuple[int, Any]]] = None
 
+        # Changes not yet sent to QML when batch_window is used:
+        # operations changing the item order in the order they happened
+        # (None if no batch is pending), and {key: {field: value}} changed
+        # since the batch started for items that are still in the model.
+        self._batch_ops:    Optional[List[List[Any]]] = None
+        self._batch_fields: Dict[Any, Dict[str, Any]] = {}
+
         if self.sync_id:
             self.instances[self.sync_id] = self
 
+            self.subscribed_proxies = [
+                proxy for sync_id, proxy in self.proxies.items()
+                if sync_id != self.sync_id and proxy.accept_source(self)
+            ]
+
 
     def __repr__(self) -> str:
         """Provide a full representation of the model and its content."""
@@ -76,6 +126,9 @@ class Model(MutableMapping):
         _changed_fields: Optional[Dict[str, Any]] = None,
     ) -> None:
         with self.write_lock:
+            if self.batching:
+                self._begin_batch()
+
             existing = self._data.get(key)
             new      = value
 
@@ -84,10 +137,7 @@ class Model(MutableMapping):
             changed_fields = _changed_fields or {}
 
             if not changed_fields:
-                for field in new.__dataclass_fields__:  # type: ignore
-                    if field.startswith("_"):
-                        continue
-
+                for field in new.qml_fields():
                     changed = True
 
                     if existing:
@@ -100,7 +150,8 @@ class Model(MutableMapping):
             # Set parent model on new item
 
             if self.sync_id and self.take_items_ownership:
-                new.parent_model = self
+                new.parent_model           = self
+                new.__dict__["_model_key"] = key
 
             # Insert into sorted data
 
@@ -110,8 +161,8 @@ class Model(MutableMapping):
                 index_then = self._sorted_data.index(existing)
                 del self._sorted_data[index_then]
 
+            index_now = self._sorted_data.bisect_key_right(new.sort_key)
             self._sorted_data.add(new)
-            index_now = self._sorted_data.index(new)
 
             # Insert into dict data
 
@@ -119,13 +170,15 @@ class Model(MutableMapping):
 
             # Callbacks
 
-            for sync_id, proxy in self.proxies.items():
-                if sync_id != self.sync_id:
-                    proxy.source_item_set(self, key, value)
+            for proxy in self.proxies_to_notify():
+                proxy.source_item_set(self, key, value)
 
             # Emit PyOtherSide event
 
-            if self.sync_id and (index_then != index_now or changed_fields):
+            if self.batching:
+                self._batch_set(key, index_then, index_now, changed_fields)
+
+            elif self.sync_id and (index_then != index_now or changed_fields):
                 ModelItemSet(
                     self.sync_id, index_then, index_now, changed_fields,
                 )
@@ -137,17 +190,23 @@ class Model(MutableMapping):
 
             if self.sync_id and self.take_items_ownership:
                 item.parent_model = None
+                item.__dict__.pop("_model_key", None)
+
+            if self.batching:
+                self._begin_batch()
 
             del self._data[key]
 
             index = self._sorted_data.index(item)
             del self._sorted_data[index]
 
-            for sync_id, proxy in self.proxies.items():
-                if sync_id != self.sync_id:
-                    proxy.source_item_deleted(self, key)
+            for proxy in self.proxies_to_notify():
+                proxy.source_item_deleted(self, key)
 
-            if self.sync_id:
+            if self.batching:
+                self._batch_delete(key, index, item.id)
+
+            elif self.sync_id:
                 if self._active_batch_removed is None:
                     i = serialize_value_for_qml(item.id, json_list_dicts=True)
                     ModelItemDeleted(self.sync_id, index, 1, (i,))
@@ -168,10 +227,86 @@ class Model(MutableMapping):
         return str(self.sync_id) < str(other.sync_id)
 
 
+    @property
+    def batching(self) -> bool:
+        """Whether changes are accumulated instead of sent to QML directly."""
+        return bool(self.sync_id) and self.batch_window > 0
+
+
     def clear(self) -> None:
-        super().clear()
-        if self.sync_id:
-            ModelCleared(self.sync_id)
+        with self.write_lock:
+            super().clear()
+
+            if self.batching:
+                self._begin_batch()
+                self._batch_ops = [["clear"]]
+                self._batch_fields.clear()
+
+            elif self.sync_id:
+                ModelCleared(self.sync_id)
+
+
+    def reset(self, items: Dict[Any, "ModelItem"]) -> None:
+        """Replace all the items of the model by the passed ones at once.
+
+        This is much faster than deleting and setting items one by one
+        when there are many of them: the items are sorted in one operation,
+        and QML receives a single `ModelBatchChanged` event which clears
+        its model and inserts every item.
+
+        Proxies are informed of deleted items, then of every passed item.
+        Subclasses overriding `__setitem__` or `__delitem__` to keep track
+        of their items must override this too.
+        """
+
+        with self.write_lock:
+            if self.batching:
+                self._begin_batch()
+
+            owned   = self.sync_id and self.take_items_ownership
+            removed = [key for key in self._data if key not in items]
+
+            if owned:
+                for item in self._data.values():
+                    item.parent_model = None
+                    item.__dict__.pop("_model_key", None)
+
+                for key, item in items.items():
+                    item.parent_model           = self
+                    item.__dict__["_model_key"] = key
+
+            self._data = dict(items)
+            self._sorted_data.clear()
+            self._sorted_data.update(items.values())
+
+            # Serialize before proxies copy the items, so that the copies
+            # share the cached serialized fields
+            serialized = {
+                key: item.serialized for key, item in items.items()
+            } if self.sync_id else {}
+
+            for proxy in self.proxies_to_notify():
+                for key in removed:
+                    proxy.source_item_deleted(self, key)
+
+                for key, item in items.items():
+                    proxy.source_item_set(self, key, item)
+
+            if self.sync_id:
+                keys = {id(item): key for key, item in items.items()}
+
+                changes: List[List[Any]] = [["clear"]]
+
+                changes += [
+                    ["set", None, index, serialized[keys[id(item)]]]
+                    for index, item in enumerate(self._sorted_data)
+                ]
+
+                if self.batching:
+                    self._batch_ops = changes
+                    self._batch_fields.clear()
+                else:
+                    ModelBatchChanged(self.sync_id, changes)
 
 
     def copy(self, sync_id: Optional[SyncId] = None) -> "Model":
@@ -180,6 +315,195 @@ class Model(MutableMapping):
         return new
 
 
+    def proxies_to_notify(self) -> List["ModelProxy"]:
+        """Return the proxies that must be informed of changes in this model.
+
+        `Model.avoided_proxy_dispatches` is increased by the number of
+        other existing proxies, which are not subscribed to this model.
+        """
+
+        subscribed = self.subscribed_proxies
+        others     = len(self.proxies) - (self.sync_id in self.proxies)
+
+        Model.avoided_proxy_dispatches += others - len(subscribed)
+        return subscribed
+
+
+    def item_fields_changed(
+        self, item: "ModelItem", fields: Dict[str, Any],
+    ) -> None:
+        """Called after `ModelItem.set_fields` changed an item's fields.
+
+        `fields` contains the new values of the fields that changed.
+        This does nothing by default, subclasses can override it to keep
+        data derived from their items up to date.
+        """
+
+
+    def upsert(
+        self, key, item_type: Type[ItemT], **fields: Any,
+    ) -> ItemT:
+        """Update the item at `key` with passed fields, or create it.
+
+        Unlike replacing an existing item with a new one, which requires
+        comparing and serializing every field of the old and new items,
+        only the passed fields are compared and the changed ones serialized.
+        Fields that aren't passed keep their current value.
+
+        If no item exists yet for `key`, one of type `item_type` is
+        created from the fields and inserted. The new or updated item is
+        returned.
+        """
+
+        with self.write_lock:
+            existing = cast(Optional[ItemT], self._data.get(key))
+
+            if existing is None:
+                new = item_type(**fields)
+                self[key] = new
+                return new
+
+            if existing.parent_model is self:
+                existing.set_fields(**fields)
+                return existing
+
+            # We don't own the item, don't modify it behind its model's back
+            new       = replace(existing, **fields)
+            self[key] = new
+            return new
+
+
+    def _begin_batch(self) -> None:
+        """Start accumulating changes and plan a flush if needed.
+
+        Must be called with the `write_lock` held, before any change is
+        made to the sorted data.
+        """
+
+        if not self.sync_id:
+            return
+
+        if self._batch_ops is None:
+            self._batch_ops = []
+        elif Model._flush_planned:
+            return
+
+        with Model._pending_lock:
+            Model.pending_batches[self.sync_id] = self
+
+            if Model._flush_planned:
+                return
+
+            loop = Model.event_loop
+
+            if loop is None:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    # No loop to plan a flush with, the batch will be sent
+                    # with the next PyOtherSideEvent or flush_batches() call
+                    return
+
+            if loop.is_closed():
+                return
+
+            loop.call_soon_threadsafe(
+                loop.call_later, self.batch_window, Model.flush_batches,
+            )
+            Model._flush_planned = True
+
+
+    def _batch_set(
+        self,
+        key,
+        index_then: Optional[int],
+        index_now:  int,
+        fields:     Dict[str, Any],
+    ) -> None:
+        """Record an item insertion, move or field changes in the batch.
+
+        Insertions and moves are recorded as operations, since the indexes
+        of later operations depend on them. Field changes of items already
+        in the model are merged and only sent when the batch is flushed.
+        """
+
+        assert self._batch_ops is not None  # nosec
+
+        if index_then is None:
+            self._batch_ops.append(["set", None, index_now, fields])
+            return
+
+        if index_then != index_now:
+            self._batch_ops.append(["set", index_then, index_now, {}])
+
+        if fields:
+            self._batch_fields.setdefault(key, {}).update(fields)
+
+
+    def _batch_delete(self, key, index: int, item_id: Any) -> None:
+        """Record an item removal in the batch.
+
+        Consecutive removals of neighbor items are merged into a single
+        operation.
+        """
+
+        assert self._batch_ops is not None  # nosec
+
+        self._batch_fields.pop(key, None)
+        item_id = serialize_value_for_qml(item_id, json_list_dicts=True)
+        last    = self._batch_ops[-1] if self._batch_ops else None
+
+        if last and last[0] == "delete" and last[1] == index:
+            last[2] += 1
+            last[3].append(item_id)
+        elif last and last[0] == "delete" and last[1] == index + 1:
+            last[1]  = index
+            last[2] += 1
+            last[3].insert(0, item_id)
+        else:
+            self._batch_ops.append(["delete", index, 1, [item_id]])
+
+
+    @staticmethod
+    def flush_batches() -> None:
+        """Send all models's pending changes to QML."""
+
+        with Model._pending_lock:
+            models = list(Model.pending_batches.values())
+            Model.pending_batches.clear()
+            Model._flush_planned = False
+
+        for model in models:
+            model.flush_batch()
+
+
+    def flush_batch(self) -> None:
+        """Send accumulated changes to QML as one `ModelBatchChanged` event.
+
+        The changes are a list of operations that QML applies in order:
+        `["clear"]`, `["delete", index, count, ids]` and
+        `["set", index_then, index_now, changed_fields]`, the latter
+        being an insertion if `index_then` is `None`.
+        Merged field changes come last, at the items' final index.
+        """
+
+        with self.write_lock:
+            changes = self._batch_ops
+
+            if changes is None:
+                return
+
+            for key, fields in self._batch_fields.items():
+                index = self._sorted_data.index(self._data[key])
+                changes.append(["set", index, index, fields])
+
+            self._batch_ops    = None
+            self._batch_fields = {}
+
+            if changes and self.sync_id:
+                ModelBatchChanged(self.sync_id, changes)
+
+
     @contextmanager
     def batch_remove(self):
         """Context manager that accumulates item removal events.
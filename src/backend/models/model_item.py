@@ -1,8 +1,10 @@
 # Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
-from dataclasses import dataclass, field
-from typing import TYPE_CHECKING, Any, Dict, Optional
+from dataclasses import dataclass, field, fields
+from typing import (
+    TYPE_CHECKING, Any, ClassVar, Collection, Dict, FrozenSet, Optional, Tuple,
+)
 
 from ..pyotherside_events import ModelItemSet
 from ..utils import serialize_value_for_qml
@@ -18,14 +20,19 @@ class ModelItem:
     This class must be subclassed and not used directly.
     All subclasses must use the `@dataclass(eq=False)` decorator.
 
-    Subclasses are also expected to implement `__lt__()`,
-    to provide support for comparisons with the `<`, `>`, `<=`, `=>` operators
-    and thus allow a `Model` to keep its data sorted.
+    Subclasses are also expected to implement `compute_sort_key()` and
+    list the fields it depends on in `sort_fields`. The returned key is
+    cached until one of these fields changes, and is used for comparisons
+    with the `<`, `>`, `<=`, `=>` operators and by `Model` to keep its
+    data sorted.
 
-    Make sure to respect SortedList requirements when implementing `__lt__()`:
+    Make sure to respect SortedKeyList requirements when implementing
+    `compute_sort_key()`:
     http://www.grantjenks.com/docs/sortedcontainers/introduction.html#caveats
     """
 
+    sort_fields: ClassVar[FrozenSet[str]] = frozenset({"id"})
+
     id: Any = field()
 
 
@@ -42,29 +49,119 @@ class ModelItem:
         raise NotImplementedError()
 
 
+    def __lt__(self, other: "ModelItem") -> bool:
+        return self.sort_key < other.sort_key
+
+
+    @property
+    def sort_key(self) -> Any:
+        """Cached `compute_sort_key()` result."""
+
+        try:
+            return self.__dict__["_cached_sort_key"]
+        except KeyError:
+            key = self.__dict__["_cached_sort_key"] = self.compute_sort_key()
+            return key
+
+
+    def compute_sort_key(self) -> Any:
+        """Return a value determining this item's position in a `Model`."""
+        return self.id
+
+
+    @classmethod
+    def qml_fields(cls) -> Tuple[str, ...]:
+        """Names of the fields passed to QML, i.e. not private ones.
+
+        Unlike `__dataclass_fields__`, class variables are excluded.
+        The result is cached for each subclass.
+        """
+
+        try:
+            return cls.__dict__["_qml_fields"]
+        except KeyError:
+            names = tuple(
+                f.name for f in fields(cls) if not f.name.startswith("_")
+            )
+            cls._qml_fields = names  # type: ignore
+            return names
+
+
     @property
     def serialized(self) -> Dict[str, Any]:
         """Return this item as a dict ready to be passed to QML."""
 
         return {
-            name: self.serialized_field(name)
-            for name in self.__dataclass_fields__  # type: ignore
-            if not name.startswith("_")
+            name: self.serialized_field(name) for name in self.qml_fields()
         }
 
 
     def serialized_field(self, field: str) -> Any:
-        """Return a field's value in a form suitable for passing to QML."""
+        """Return a field's value in a form suitable for passing to QML.
+
+        The result is cached until the field is changed with `set_fields`.
+        Subclasses needing a custom conversion should override
+        `_serialize_field()`.
+        """
+
+        cache = self.__dict__.setdefault("_serialized_cache", {})
+
+        try:
+            return cache[field]
+        except KeyError:
+            value = cache[field] = self._serialize_field(field)
+            return value
+
+
+    def _serialize_field(self, field: str) -> Any:
+        """Convert a field's value for `serialized_field()`."""
 
         value = getattr(self, field)
         return serialize_value_for_qml(value, json_list_dicts=True)
 
 
+    def lowercase_field(self, field: str) -> str:
+        """Return a string field's value in lowercase.
+
+        The result is cached until the field is changed with `set_fields`.
+        """
+
+        cache = self.__dict__.setdefault("_lowercase_cache", {})
+
+        try:
+            return cache[field]
+        except KeyError:
+            value = cache[field] = getattr(self, field).lower()
+            return value
+
+
+    def _invalidate_caches(self, changed: Collection[str]) -> None:
+        """Forget cached values depending on the passed changed fields."""
+
+        if not self.sort_fields.isdisjoint(changed):
+            self.__dict__.pop("_cached_sort_key", None)
+
+        for name in ("_serialized_cache", "_lowercase_cache"):
+            cache = self.__dict__.get(name)
+
+            if cache and not cache.keys().isdisjoint(changed):
+                # The cache dict may be shared with copies of this item made by
+                # proxies, so it must be replaced rather than modified in place
+                self.__dict__[name] = {
+                    k: v for k, v in cache.items() if k not in changed
+                }
+
+
     def set_fields(self, _force: bool = False, **fields: Any) -> None:
         """Set one or more field's value and call `ModelItem.notify_change`.
 
         For efficiency, to change multiple fields, this method should be
         used rather than setting them one after another with `=` or `setattr`.
+
+        Only the passed fields are compared to their current value, and only
+        those which actually changed are serialized and sent to QML.
+        The item is only moved inside its parent model if one of the
+        `sort_fields` changed.
         """
 
         parent = self.parent_model
@@ -73,8 +170,18 @@ class ModelItem:
         if not parent:
             for name, value in fields.items():
                 super().__setattr__(name, value)
+
+            cached = self.__dict__
+
+            if "_cached_sort_key" in cached or \
+               "_serialized_cache" in cached or \
+               "_lowercase_cache" in cached:
+                self._invalidate_caches(fields)
             return
 
+        # Key of the item in its parent, not necessarily equal to the id
+        key = self.__dict__.get("_model_key", self.id)
+
         with parent.write_lock:
             qml_changes = {}
             changes     = {
@@ -85,21 +192,38 @@ class ModelItem:
             if not changes:
                 return
 
+            if parent.batching:
+                parent._begin_batch()
+
+            resort     = not self.sort_fields.isdisjoint(changes)
+            index_then = index_now = None
+
+            if resort or not parent.batching:
+                index_then = index_now = parent._sorted_data.index(self)
+
             # To avoid corrupting the SortedList, we have to take out the item,
             # apply the field changes, *then* add it back in.
 
-            index_then = parent._sorted_data.index(self)
-            del parent._sorted_data[index_then]
+            if resort:
+                del parent._sorted_data[index_then]
 
             for name, value in changes.items():
                 super().__setattr__(name, value)
-                is_field = name in self.__dataclass_fields__  # type: ignore
 
-                if is_field and not name.startswith("_"):
+            self._invalidate_caches(changes)
+
+            qml_fields = self.qml_fields()
+
+            for name in changes:
+                if name in qml_fields:
                     qml_changes[name] = self.serialized_field(name)
 
-            parent._sorted_data.add(self)
-            index_now    = parent._sorted_data.index(self)
+            if resort:
+                index_now = parent._sorted_data.bisect_key_right(self.sort_key)
+                parent._sorted_data.add(self)
+
+            parent.item_fields_changed(self, changes)
+
             index_change = index_then != index_now
 
             # Now, inform QML about changed dataclass fields if any.
@@ -107,13 +231,23 @@ class ModelItem:
             if not parent.sync_id or (not qml_changes and not index_change):
                 return
 
-            ModelItemSet(parent.sync_id, index_then, index_now, qml_changes)
+            if parent.batching and resort:
+                assert index_now is not None  # nosec
+                parent._batch_set(key, index_then, index_now, qml_changes)
+            elif parent.batching:
+                parent._batch_fields.setdefault(key, {}).update(qml_changes)
+            else:
+                # Indexes are always found when the parent isn't batching
+                assert index_then is not None  # nosec
+                assert index_now is not None  # nosec
+                ModelItemSet(
+                    parent.sync_id, index_then, index_now, qml_changes,
+                )
 
         # Inform any proxy connected to the parent model of the field changes
 
-        for sync_id, proxy in parent.proxies.items():
-            if sync_id != parent.sync_id:
-                proxy.source_item_set(parent, self.id, self, qml_changes)
+        for proxy in parent.proxies_to_notify():
+            proxy.source_item_set(parent, key, self, qml_changes)
 
 
     def notify_change(self, *fields: str) -> None:
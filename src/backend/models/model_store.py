@@ -8,8 +8,8 @@ from typing import Dict, List, Union
 from . import SyncId
 from .model import Model
 from .special_models import (
-    AllRooms, AutoCompletedMembers, FilteredHomeservers, FilteredMembers,
-    MatchingAccounts,
+    AccountRooms, AllRooms, AutoCompletedMembers, FilteredHomeservers,
+    FilteredMembers, MatchingAccounts,
 )
 
 
@@ -42,6 +42,8 @@ class ModelStore(UserDict):
             model = MatchingAccounts(self["all_rooms"])
         elif key == "filtered_homeservers":
             model = FilteredHomeservers()
+        elif is_tuple and len(key) == 2 and key[1] == "rooms":
+            model = AccountRooms(user_id=key[0], accounts=self["accounts"])
         elif is_tuple and len(key) == 3 and key[2] == "filtered_members":
             model = FilteredMembers(user_id=key[0], room_id=key[1])
         elif is_tuple and len(key) == 3 and key[2] == "autocompleted_members":
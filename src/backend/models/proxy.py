@@ -12,7 +12,12 @@ if TYPE_CHECKING:
 
 
 class ModelProxy(Model):
-    """Proxies data from one or more `Model` objects."""
+    """Proxies data from one or more `Model` objects.
+
+    When either a proxy or another model is created, the proxy subscribes to
+    the model if `accept_source()` returns `True` for it. Changes in a model
+    are only dispatched to its subscribed proxies.
+    """
 
     def __init__(self, sync_id: SyncId) -> None:
         super().__init__(sync_id)
@@ -22,12 +27,18 @@ class ModelProxy(Model):
         with self.write_lock:
             for sync_id, model in Model.instances.items():
                 if sync_id != self.sync_id and self.accept_source(model):
+                    model.subscribed_proxies.append(self)
+
                     for key, item in model.items():
                         self.source_item_set(model, key, item)
 
 
     def accept_source(self, source: Model) -> bool:
-        """Return whether passed `Model` should be proxied by this proxy."""
+        """Return whether passed `Model` should be proxied by this proxy.
+
+        This is checked once when the proxy or source is created, the result
+        must not change afterwards.
+        """
         return True
 
 
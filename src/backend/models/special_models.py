@@ -1,24 +1,228 @@
 # Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import os
 from dataclasses import asdict
-from typing import Dict, Set
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Set, Tuple
 
+from . import SyncId
 from .filters import FieldStringFilter, FieldSubstringFilter, ModelFilter
 from .items import Account, AccountOrRoom, Room
 from .model import Model
 from .model_item import ModelItem
 
+# (unreads, highlights, local_unreads)
+UnreadCounts = Tuple[int, int, bool]
+
+
+class AccountRooms(Model):
+    """Rooms of an account, which keep the account's unread totals updated.
+
+    The `Account` item's `total_unread`, `total_highlights` and
+    `local_unreads` fields are updated from the difference between a room's
+    old and new counts whenever a room is added, removed or has one of
+    these fields changed, instead of summing the counts of every room.
+
+    If the `MIRAGE_CHECK_UNREAD_TOTALS` environment variable is set,
+    the totals are compared to the sums of all rooms after every update,
+    and an `AssertionError` is raised if they differ.
+    """
+
+    counted_fields: ClassVar[Set[str]] = {
+        "unreads", "highlights", "local_unreads",
+    }
+
+    check_totals: ClassVar[bool] = \
+        bool(os.environ.get("MIRAGE_CHECK_UNREAD_TOTALS"))
+
+    def __init__(self, user_id: str, accounts: Model) -> None:
+        self.user_id  = user_id
+        self.accounts = accounts
+
+        # {room_id: counts included in the totals for that room}
+        self._counted: Dict[str, UnreadCounts] = {}
+
+        self.total_unread:       int = 0
+        self.total_highlights:   int = 0
+        self.local_unread_rooms: int = 0
+
+        super().__init__(sync_id=(user_id, "rooms"))
+
+
+    def __setitem__(
+        self,
+        key,
+        value: ModelItem,
+        _changed_fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        with self.write_lock:
+            super().__setitem__(key, value, _changed_fields)
+            self._count(key, value)
+
+
+    def __delitem__(self, key) -> None:
+        with self.write_lock:
+            super().__delitem__(key)
+            self._count(key, None)
+
+
+    def reset(self, items: Dict[Any, ModelItem]) -> None:
+        with self.write_lock:
+            super().reset(items)
+
+            # Items are replaced without going through __setitem__, so the
+            # totals are recomputed from every room instead of adjusted
+            self._counted = {
+                key: (room.unreads, room.highlights, room.local_unreads)
+                for key, room in items.items()
+                if isinstance(room, Room)
+            }
+
+            counts                  = self._counted.values()
+            self.total_unread       = sum(count[0] for count in counts)
+            self.total_highlights   = sum(count[1] for count in counts)
+            self.local_unread_rooms = sum(count[2] for count in counts)
+
+            self._update_account()
+
+            if self.check_totals:
+                self.verify_totals()
+
+
+    def copy(self, sync_id: Optional[SyncId] = None) -> Model:
+        # Copies are plain snapshots and must not update the account
+        new = Model(sync_id=sync_id)
+        new.update(self)
+        return new
+
+
+    def item_fields_changed(
+        self, item: ModelItem, fields: Dict[str, Any],
+    ) -> None:
+        if not self.counted_fields.isdisjoint(fields):
+            self._count(item.id, item)
+
+
+    def verify_totals(self) -> None:
+        """Raise an `AssertionError` if totals don't match the rooms' counts.
+        """
+
+        expected = (
+            sum(room.unreads for room in self.values()),
+            sum(room.highlights for room in self.values()),
+            sum(room.local_unreads for room in self.values()),
+        )
+        current = (
+            self.total_unread, self.total_highlights, self.local_unread_rooms,
+        )
+
+        assert current == expected, \
+            f"{self.sync_id}: totals {current} != {expected}"  # nosec
+
+
+    def _count(self, room_id: str, room: Optional[ModelItem]) -> None:
+        """Update the account's totals for a room's new counts."""
+
+        assert room is None or isinstance(room, Room)  # nosec
+
+        old = self._counted.pop(room_id, (0, 0, False))
+        new = (0, 0, False)
+
+        if room:
+            new = (room.unreads, room.highlights, room.local_unreads)
+            self._counted[room_id] = new
+
+        if new != old:
+            self.total_unread       += new[0] - old[0]
+            self.total_highlights   += new[1] - old[1]
+            self.local_unread_rooms += new[2] - old[2]
+            self._update_account()
+
+        if self.check_totals:
+            self.verify_totals()
+
+
+    def _update_account(self) -> None:
+        """Set the account item's fields to the current totals."""
+
+        account = self.accounts.get(self.user_id)
+
+        if account:
+            account.set_fields(
+                total_unread     = self.total_unread,
+                total_highlights = self.total_highlights,
+                local_unreads    = bool(self.local_unread_rooms),
+            )
+
 
 class AllRooms(FieldSubstringFilter):
-    """Flat filtered list of all accounts and their rooms."""
+    """Flat filtered list of all accounts and their rooms.
+
+    When a filter is set, accounts are only shown if they have at least one
+    matching room. To avoid scanning the model for these, the number of
+    shown rooms for each account is kept up to date as rooms are added and
+    removed, and an account is only rechecked when its count becomes zero or
+    stops being zero.
+    """
 
     def __init__(self, accounts: Model) -> None:
         self.accounts = accounts
         self._collapsed: Set[str] = set()
 
+        # {user_id: number of shown rooms}
+        self._shown_rooms: Dict[str, int] = {}
+
+        # Called when an account is shown or hidden
+        self.accounts_changed_callbacks: List[Callable[[], None]] = []
+
         super().__init__(sync_id="all_rooms", fields=("display_name",))
-        self.items_changed_callbacks.append(self.refilter_accounts)
+
+
+    def __setitem__(
+        self,
+        key,
+        value: ModelItem,
+        _changed_fields: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        assert isinstance(value, AccountOrRoom)  # nosec
+
+        with self.write_lock:
+            new = key not in self
+            super().__setitem__(key, value, _changed_fields)
+
+            if not new:
+                return
+
+            if value.type is Account:
+                for callback in self.accounts_changed_callbacks:
+                    callback()
+                return
+
+            user_id                    = value.for_account
+            self._shown_rooms[user_id] = self._shown_rooms.get(user_id, 0) + 1
+
+            if self._shown_rooms[user_id] == 1:
+                self.update_account_visibility(user_id)
+
+
+    def __delitem__(self, key) -> None:
+        with self.write_lock:
+            item = self[key]
+            assert isinstance(item, AccountOrRoom)  # nosec
+
+            super().__delitem__(key)
+
+            if item.type is Account:
+                for callback in self.accounts_changed_callbacks:
+                    callback()
+                return
+
+            user_id                     = item.for_account
+            self._shown_rooms[user_id] -= 1
+
+            if not self._shown_rooms[user_id]:
+                del self._shown_rooms[user_id]
+                self.update_account_visibility(user_id)
 
 
     def set_account_collapse(self, user_id: str, collapsed: bool) -> None:
@@ -68,13 +272,41 @@ class AllRooms(FieldSubstringFilter):
         if item.type is not Account or not self.filter:
             return matches_filter
 
-        return next(
-            (i for i in self.values() if i.for_account == item.id), False,
-        )
+        return item.id in self._shown_rooms
+
+
+    def refilter(
+        self,
+        only_if:              Optional[Callable[[ModelItem], bool]] = None,
+        recheck_shown:        bool = True,
+        recheck_filtered_out: bool = True,
+    ) -> None:
+        # Accounts are updated as their shown rooms count changes, but the
+        # filter being set or removed also changes whether they're accepted
+
+        def rooms_only(item: ModelItem) -> bool:
+            assert isinstance(item, AccountOrRoom)  # nosec
+            return item.type is Room and (not only_if or only_if(item))
+
+        with self.write_lock:
+            super().refilter(rooms_only, recheck_shown, recheck_filtered_out)
+
+            for user_id in tuple(self.accounts):
+                self.update_account_visibility(user_id)
 
 
-    def refilter_accounts(self) -> None:
-        self.refilter(lambda i: i.type is Account)  # type: ignore
+    def update_account_visibility(self, user_id: str) -> None:
+        """Show or hide an account depending on `accept_item()`."""
+
+        key = ("accounts", user_id)
+
+        with self.write_lock:
+            if key in self.filtered_out:
+                if self.accept_item(self.filtered_out[key]):
+                    self[key] = self.filtered_out.pop(key)
+
+            elif key in self and not self.accept_item(self[key]):
+                self.filtered_out[key] = self.pop(key)
 
 
 class MatchingAccounts(ModelFilter):
@@ -84,7 +316,7 @@ class MatchingAccounts(ModelFilter):
 
     def __init__(self, all_rooms: AllRooms) -> None:
         self.all_rooms = all_rooms
-        self.all_rooms.items_changed_callbacks.append(self.refilter)
+        self.all_rooms.accounts_changed_callbacks.append(self.refilter)
 
         super().__init__(sync_id="matching_accounts")
 
@@ -94,13 +326,7 @@ class MatchingAccounts(ModelFilter):
 
 
     def accept_item(self, item: ModelItem) -> bool:
-        if not self.all_rooms.filter:
-            return True
-
-        return next(
-            (i for i in self.all_rooms.values() if i.id == item.id),
-            False,
-        )
+        return ("accounts", item.id) in self.all_rooms
 
 
 class FilteredMembers(FieldSubstringFilter):
@@ -111,7 +337,11 @@ class FilteredMembers(FieldSubstringFilter):
         self.room_id = room_id
         sync_id      = (user_id, room_id, "filtered_members")
 
-        super().__init__(sync_id=sync_id, fields=("display_name",))
+        super().__init__(
+            sync_id = sync_id,
+            fields  = ("display_name",),
+            indexed = True,
+        )
 
 
     def accept_source(self, source: Model) -> bool:
@@ -130,6 +360,7 @@ class AutoCompletedMembers(FieldStringFilter):
             sync_id                    = sync_id,
             fields                     = ("display_name", "id"),
             no_filter_accept_all_items = False,
+            indexed                    = True,
         )
 
 
@@ -146,7 +377,11 @@ class FilteredHomeservers(FieldSubstringFilter):
     """Filtered list of public Matrix homeservers."""
 
     def __init__(self) -> None:
-        super().__init__(sync_id="filtered_homeservers", fields=("id", "name"))
+        super().__init__(
+            sync_id = "filtered_homeservers",
+            fields  = ("id", "name"),
+            indexed = True,
+        )
 
 
     def accept_source(self, source: Model) -> bool:
@@ -1,13 +1,14 @@
 # Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import itertools
 import json
 import logging as log
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from html import escape
 from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple, Union
 from urllib.parse import quote
 
 import nio
@@ -46,6 +47,10 @@ class NioCallbacks:
 
         self.models = self.client.models
 
+        # Registered first, to let other coroutines run between the events
+        # of large sync responses
+        self.client.add_event_callback(self.cooperate, nio.Event)
+
         for name, response_class in classes_defined_in(nio.responses).items():
             method = getattr(self, f"on{name}", None)
 
@@ -75,26 +80,77 @@ class NioCallbacks:
         return self.client.user_id
 
 
+    async def cooperate(self, _room: nio.MatrixRoom, _ev: nio.Event) -> None:
+        await self.client.backend.sync_scheduler.cooperate()
+
+
     # Response callbacks
 
     async def onSyncResponse(self, resp: nio.SyncResponse) -> None:
+        # Rooms that had events while the response was being processed,
+        # see MatrixClient.register_nio_room()
+        to_register                              = \
+            self.client.rooms_to_register_after_sync
+        self.client.rooms_to_register_after_sync = set()
+
+        cooperate = self.client.backend.sync_scheduler.cooperate
+
         for room_id in resp.rooms.invite:
+            await cooperate()
+            to_register.discard(room_id)
             await self.client.register_nio_room(self.client.all_rooms[room_id])
 
         for room_id, info in resp.rooms.join.items():
-            await self.client.register_nio_room(self.client.rooms[room_id])
+            await cooperate()
+            to_register.discard(room_id)
 
             if room_id not in self.client.past_tokens:
-                self.client.past_tokens[room_id] = info.timeline.prev_batch
+                token = info.timeline.prev_batch
+                dates = [ev.server_timestamp for ev in info.timeline.events]
+                date  = \
+                    datetime.fromtimestamp(min(dates) / 1000) if dates else \
+                    datetime.now()
+
+                self.client.past_tokens[room_id] = token
+                self.client.past_pages[room_id]  = [(date, token)]
+                self.client.past_tokens_known[room_id].set()
+
+                # Events restored from the cache may not be followed by
+                # those we got, unload them so that they're loaded again
+                model = self.models.data.get((self.user_id, room_id, "events"))
+
+                if info.timeline.limited and dates and model:
+                    old = [k for k, ev in model.items() if ev.date < date]
+
+                    with model.batch_remove():
+                        for key in old:
+                            del model[key]
 
             for ev in info.state:
                 if isinstance(ev, nio.PowerLevelsEvent):
                     stored = self.client.power_level_events.get(room_id)
                     time   = ev.server_timestamp
 
+                    # nio updated the room's PowerLevels object in place
+                    self.client.power_level_fields.pop(room_id, None)
+
                     if not stored or time > stored.server_timestamp:
                         self.client.power_level_events[room_id] = ev
 
+            await self.client.register_nio_room(self.client.rooms[room_id])
+
+        for room_id in to_register - resp.rooms.leave.keys():
+            await cooperate()
+
+            if room_id in self.client.all_rooms:
+                await self.client.register_nio_room(
+                    self.client.all_rooms[room_id],
+                )
+
+        for room_id in tuple(self.client.pending_read_by):
+            await cooperate()
+            self.client.apply_read_receipts(room_id)
+
         # TODO: way of knowing if a nio.MatrixRoom is left
         for room_id, info in resp.rooms.leave.items():
             # We forgot this room or rejected an invite and ignored the sender
@@ -121,6 +177,13 @@ class NioCallbacks:
         account.connecting = False
 
         if not self.client.first_sync_done.is_set():
+            # Rooms restored from the cache that we're no longer part of
+            for room_id in self.client.cached_rooms:
+                self.models[self.user_id, "rooms"].pop(room_id, None)
+                self.models.pop((self.user_id, room_id, "events"), None)
+                self.models.pop((self.user_id, room_id, "members"), None)
+
+            self.client.cached_rooms.clear()
             self.client.first_sync_done.set()
             self.client.first_sync_date = datetime.now()
 
@@ -233,7 +296,7 @@ class NioCallbacks:
             thumbnail_crypt_dict = thumb_crypt_dict,
         )
 
-        self.client.backend.mxc_events[ev.url].append(item)
+        self.client.backend.mxc_events.add(ev.url, item)
 
 
     async def onRoomEncryptedMedia(
@@ -260,15 +323,17 @@ class NioCallbacks:
             await self.client.register_nio_room(room)
             return
 
-        event.source.source["content"]  = {}
-        event.source.source["unsigned"] = {
+        source = event.nio_source.source
+
+        source["content"]  = {}
+        source["unsigned"] = {
             "redacted_by":      ev.event_id,
             "redacted_because": ev.source,
         }
 
         await self.onRedactedEvent(
             room,
-            nio.RedactedEvent.from_dict(event.source.source),
+            nio.RedactedEvent.from_dict(source),
             event_id = event.id,
         )
 
@@ -354,6 +419,9 @@ class NioCallbacks:
         levels = ev.power_levels
         stored = self.client.power_level_events.get(room.room_id)
 
+        # nio updated the room's PowerLevels object in place
+        self.client.power_level_fields.pop(room.room_id, None)
+
         if not stored or ev.server_timestamp > stored.server_timestamp:
             self.client.power_level_events[room.room_id] = ev
 
@@ -729,11 +797,26 @@ class NioCallbacks:
     async def onReceiptEvent(
         self, room: nio.MatrixRoom, ev: nio.ReceiptEvent,
     ) -> None:
-        member_model    = self.models[self.user_id, room.room_id, "members"]
-        event_model     = self.models[self.user_id, room.room_id, "events"]
+        room_id         = room.room_id
+        member_model    = self.models[self.user_id, room_id, "members"]
+        event_model     = self.models[self.user_id, room_id, "events"]
         unassigned_mems = self.client.unassigned_member_last_read_event
         unassigned_evs  = self.client.unassigned_event_last_read_by
-        recount_markers = []
+        pending         = self.client.pending_read_by[room_id]
+
+        def read_by(event_id: str) -> Dict[str, int]:
+            # Copied rather than modified in place, as compacted events
+            # share the same empty dict
+            if event_id not in pending:
+                pending[event_id] = dict(event_model[event_id].last_read_by)
+
+            return pending[event_id]
+
+        def forget_oldest(unassigned: Dict[Any, Any]) -> None:
+            excess = len(unassigned) - self.client.max_unassigned_receipts
+
+            for key in tuple(itertools.islice(unassigned, max(0, excess))):
+                del unassigned[key]
 
         for receipt in ev.receipts:
             if receipt.user_id in self.client.backend.clients:
@@ -742,37 +825,39 @@ class NioCallbacks:
             if receipt.receipt_type != "m.read":
                 continue
 
-            echo_id    = self.client.event_to_echo_ids.get(receipt.event_id)
-            read_event = event_model.get(echo_id or receipt.event_id)
-            timestamp  = receipt.timestamp
+            echo_id   = self.client.event_to_echo_ids.get(receipt.event_id)
+            read_id   = echo_id or receipt.event_id
+            timestamp = receipt.timestamp
 
-            if read_event:
-                recount_markers.append(read_event)
-                read_event.last_read_by[receipt.user_id] = timestamp
-                read_event.notify_change("last_read_by")
+            if read_id in event_model:
+                read_by(read_id)[receipt.user_id] = timestamp
             else:
                 # We haven't received the read event from the server yet
-                unassigned_evs[receipt.event_id][receipt.user_id] = timestamp
+                readers = unassigned_evs.pop(receipt.event_id, {})
+                readers[receipt.user_id] = timestamp
+                unassigned_evs[receipt.event_id] = readers
 
             if receipt.user_id not in member_model:
                 # We haven't loaded the member yet (lazy loading), or they left
-                unassigned_mems[room.room_id, receipt.user_id] = \
-                    echo_id or receipt.event_id
+                unassigned_mems.pop((room_id, receipt.user_id), None)
+                unassigned_mems[room_id, receipt.user_id] = read_id
                 continue
 
-            member              = member_model[receipt.user_id]
-            previous_read_event = event_model.get(member.last_read_event)
+            member   = member_model[receipt.user_id]
+            previous = member.last_read_event
 
-            if previous_read_event:
+            if previous != read_id and previous in event_model:
                 # Remove the read marker from the previous last read event
-                recount_markers.append(previous_read_event)
-                previous_read_event.last_read_by.pop(receipt.user_id, None)
-                previous_read_event.notify_change("last_read_by")
+                read_by(previous).pop(receipt.user_id, None)
+
+            member.last_read_event = read_id
 
-            member.last_read_event = echo_id or receipt.event_id
+        # Forget the oldest receipts for events and members never loaded
+        forget_oldest(unassigned_evs)
+        forget_oldest(unassigned_mems)
 
-        for ev in recount_markers:
-            ev.read_by_count = len(ev.last_read_by)
+        if not self.client.processing_sync:
+            self.client.apply_read_receipts(room_id)
 
 
     # Account data callbacks
@@ -917,12 +1002,20 @@ class NioCallbacks:
         else:
             presence.last_active_at = datetime.fromtimestamp(0)
 
-        # Add all existing members related to this presence
-        for room_id in self.models[self.user_id, "rooms"]:
-            members = self.models[self.user_id, room_id, "members"]
+        # Add all existing members related to this presence. Rooms that were
+        # left or forgotten since their members were registered are skipped.
+        members = self.client.members_by_user.get(ev.user_id, {})
+
+        for room_id, member in tuple(members.items()):
+            model = self.models.data.get((self.user_id, room_id, "members"))
+
+            if model and model.get(ev.user_id) is member:
+                presence.members[room_id] = member
+            else:
+                del members[room_id]
 
-            if ev.user_id in members:
-                presence.members[room_id] = members[ev.user_id]
+        if not members:
+            self.client.members_by_user.pop(ev.user_id, None)
 
         presence.update_members()
 
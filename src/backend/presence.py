@@ -27,9 +27,10 @@ class Presence:
     registering an `Account` model item.
 
     When receiving a `PresenceEvent`, we get or create a `Presence` object in
-    `Backend.presences` for the targeted user. If the user is registered in any
-    room, add its `Member` model item to `members`. Finally, update every
-    `Member` presence fields inside `members`.
+    `Backend.presences` for the targeted user. The `Member` model items of
+    that user, found in `MatrixClient.members_by_user`, are added to
+    `members`. Finally, update every `Member` presence fields inside
+    `members`.
 
     When a room member is registered, we try to find a `Presence` in
     `Backend.presences` for that user ID. If found, the `Member` item is added
@@ -77,12 +78,17 @@ class Presence:
         """
 
         for member in self.members.values():
-            member.set_fields(
-                presence         = self.presence,
-                status_msg       = self.status_msg,
-                last_active_at   = self.last_active_at,
-                currently_active = self.currently_active,
-            )
+            self.update_member(member)
+
+    def update_member(self, member: "Member") -> None:
+        """Update the presence fields of a single `Member`."""
+
+        member.set_fields(
+            presence         = self.presence,
+            status_msg       = self.status_msg,
+            last_active_at   = self.last_active_at,
+            currently_active = self.currently_active,
+        )
 
     def update_account(self) -> None:
         """Update presence fields of `Account` related to this `Presence`."""
@@ -3,7 +3,9 @@
 
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, Type, Union
+from typing import (
+    TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Type, Union,
+)
 
 import pyotherside
 
@@ -19,6 +21,12 @@ class PyOtherSideEvent:
     """Event that will be sent on instanciation to QML by PyOtherSide."""
 
     def __post_init__(self) -> None:
+        # Model changes that are waiting to be sent as a batch must reach QML
+        # before anything else, e.g. the CoroutineDone of whatever made them
+        if not isinstance(self, ModelEvent):
+            from .models.model import Model
+            Model.flush_batches()
+
         # XXX: CPython 3.6 or any Python implemention >= 3.7 is required for
         # correct __dataclass_fields__ dict order.
         args = [
@@ -112,6 +120,16 @@ class ModelCleared(ModelEvent):
     """Indicate that a `Backend` `Model` was cleared."""
 
 
+@dataclass
+class ModelBatchChanged(ModelEvent):
+    """Indicate multiple accumulated changes in a `Backend` `Model`.
+
+    See `Model.flush_batch()` for the format of `changes`.
+    """
+
+    changes: List[List[Any]] = field()
+
+
 @dataclass
 class DevicesUpdated(PyOtherSideEvent):
     """Indicate changes in devices for us or users we share a room with."""
@@ -49,6 +49,9 @@ class QMLBridge:
             asyncio.set_event_loop(self._loop)
         self._loop.set_exception_handler(self._loop_exception_handler)
 
+        from .models.model import Model
+        Model.event_loop = self._loop
+
         from .backend import Backend
         self.backend: Backend = Backend()
 
@@ -0,0 +1,181 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Coordination of the sync loops of all accounts."""
+
+import asyncio
+import logging as log
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, ClassVar, Dict, Tuple
+
+from .utils import asynccontextmanager
+
+if TYPE_CHECKING:
+    from .backend import Backend
+
+
+@dataclass
+class SyncScheduler:
+    """Keep the sync loops of our accounts from starving the event loop.
+
+    Every client runs its sync loop and UI-requested coroutines on the same
+    asyncio loop. To know when that loop is saturated, its lag (how late a
+    sleeping coroutine wakes up compared to what it asked for) is measured
+    every `lag_check_interval` seconds and stored in `loop_lag`, which
+    slowly decays back to 0 once the loop is responsive again.
+    The time taken to process sync responses is also tracked for each
+    account in `processing_times`.
+
+    While `loop_lag` is over `lag_threshold`, accounts other than the one
+    currently shown in the UI wait for the loop to recover before
+    processing a sync response, and their next sync is delayed in
+    proportion to how long their previous responses took to process and
+    how saturated the loop is. The visible account never waits.
+
+    Code processing large amounts of data, such as sync response callbacks,
+    should regularly call `cooperate()`, which lets other coroutines run
+    once `time_slice` seconds have passed since it last did. Other
+    coroutines thus wait about `time_slice` at most, except for work done
+    between two calls, e.g. by nio for a single room or by Python's
+    garbage collector, which can take around 100ms for a large response.
+    """
+
+    backend: "Backend" = field(repr=False)
+
+    lag_check_interval: ClassVar[float] = 0.25
+    lag_threshold:      ClassVar[float] = 0.05
+    lag_decay:          ClassVar[float] = 0.8
+    max_sync_delay:     ClassVar[float] = 10
+    time_slice:         ClassVar[float] = 0.05
+
+    # Seconds, see class docstring
+    loop_lag:     float = field(init=False, default=0)
+    max_loop_lag: float = field(init=False, default=0)
+
+    # {user_id: seconds} - moving average
+    processing_times: Dict[str, float] = field(
+        init=False, default_factory=dict,
+    )
+
+    _slice_start: float = field(
+        init=False, repr=False, default_factory=time.monotonic,
+    )
+
+    def __post_init__(self) -> None:
+        self._monitor = asyncio.ensure_future(self._monitor_lag())
+
+
+    @property
+    def visible_user_and_room(self) -> Tuple[str, str]:
+        """Return the account and room IDs of the page shown in the UI.
+
+        An empty string is returned for the room ID if no room page is
+        shown, and for both if no account-specific page is shown.
+        """
+
+        props = self.backend.ui_state.data.get("pageProperties") or {}
+
+        if props.get("userRoomId"):
+            user_id, room_id = props["userRoomId"]
+            return (user_id, room_id)
+
+        return (props.get("userId") or "", "")
+
+
+    def sync_delay(self, user_id: str) -> float:
+        """Return how many seconds to wait before an account's next sync."""
+
+        if self.loop_lag < self.lag_threshold:
+            return 0
+
+        if user_id == self.visible_user_and_room[0]:
+            return 0
+
+        saturation = self.loop_lag / self.lag_threshold
+        delay      = self.processing_times.get(user_id, 0) * saturation
+        return min(self.max_sync_delay, delay)
+
+
+    async def wait_before_sync(self, user_id: str) -> None:
+        """Sleep for `sync_delay()` seconds if needed."""
+
+        delay = self.sync_delay(user_id)
+
+        if delay:
+            log.debug(
+                "Delaying %s sync by %.2fs, loop lag is %.3fs",
+                user_id, delay, self.loop_lag,
+            )
+            await asyncio.sleep(delay)
+
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the measured loop lag and processing times."""
+
+        return {
+            "loop_lag":         self.loop_lag,
+            "max_loop_lag":     self.max_loop_lag,
+            "processing_times": dict(self.processing_times),
+        }
+
+
+    async def cooperate(self) -> None:
+        """Let other coroutines run if the current time slice is over."""
+
+        if time.monotonic() - self._slice_start >= self.time_slice:
+            # sleep(0) would only let the loop run once, while coroutines
+            # woken up by a timer or future need a few iterations to resume,
+            # so they would wait for several time slices
+            await asyncio.sleep(0.001)
+            self._slice_start = time.monotonic()
+
+
+    @asynccontextmanager
+    async def processing(self, user_id: str) -> AsyncIterator[None]:
+        """Context manager to wrap the processing of a sync response.
+
+        Unless `user_id` is the visible account, waits up to
+        `max_sync_delay` seconds for `loop_lag` to go under `lag_threshold`
+        first. This staggers the responses of background accounts instead of
+        processing them all while the loop is saturated; once started, they
+        interleave with each other as their callbacks call `cooperate()`.
+        The processing time is then measured.
+        """
+
+        if user_id != self.visible_user_and_room[0]:
+            waited = 0.0
+
+            while self.loop_lag >= self.lag_threshold and \
+                    waited < self.max_sync_delay:
+
+                await asyncio.sleep(self.lag_check_interval)
+                waited += self.lag_check_interval
+
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self._record_processing_time(user_id, time.monotonic() - start)
+
+
+    def _record_processing_time(self, user_id: str, seconds: float) -> None:
+        previous = self.processing_times.get(user_id, seconds)
+        self.processing_times[user_id] = previous * 0.7 + seconds * 0.3
+
+
+    async def _monitor_lag(self) -> None:
+        """Update `loop_lag` every `lag_check_interval` seconds."""
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.lag_check_interval)
+
+            lag               = time.monotonic() - start
+            lag              -= self.lag_check_interval
+            self.loop_lag     = max(lag, self.loop_lag * self.lag_decay)
+            self.max_loop_lag = max(lag, self.max_loop_lag)
+
+            if lag > 1:
+                log.warning("Event loop lagged by %.2fs", lag)
@@ -0,0 +1,149 @@
+# Copyright Mirage authors & contributors <https://github.com/mirukana/mirage>
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Unloading and compaction of room events that aren't being shown."""
+
+import asyncio
+import logging as log
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, ClassVar, Dict, List, Set, Tuple
+
+from .pyotherside_events import LoopException
+
+if TYPE_CHECKING:
+    from .backend import Backend
+    from .matrix_client import MatrixClient
+
+
+@dataclass
+class TimelineEviction:
+    """Keep the number of `Event` items loaded in memory bounded.
+
+    Every `check_interval` seconds:
+
+    - Rooms that aren't shown in the UI have their oldest pages of events
+      unloaded, keeping at least their `room_window` most recent events;
+
+    - If more events than the `Chat.max_loaded_events` setting are still
+      loaded for all accounts, the timelines of the rooms that weren't
+      viewed for the longest time are unloaded, except for the events
+      received since their client started.
+
+    The events still loaded in rooms that aren't shown are also compacted,
+    see `Event.compact()`.
+
+    Unloaded events can be loaded again by `MatrixClient.load_past_events`
+    when the user scrolls up, see `MatrixClient.evict_past_events`.
+    """
+
+    backend: "Backend" = field(repr=False)
+
+    check_interval: ClassVar[float] = 10
+    room_window:    ClassVar[int]   = 200
+
+    # {(user_id, room_id): time.monotonic() when it was last seen shown}
+    last_viewed: Dict[Tuple[str, str], float] = field(
+        init=False, default_factory=dict,
+    )
+
+    # {(user_id, room_id)} whose events were all compacted at some point
+    compacted_rooms: Set[Tuple[str, str]] = field(
+        init=False, default_factory=set,
+    )
+
+    def __post_init__(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+
+    def evict(self) -> int:
+        """Unload events as described in the class docstring.
+
+        Returns the number of events that were unloaded.
+        """
+
+        visible = self.backend.sync_scheduler.visible_user_and_room
+        self.last_viewed[visible] = time.monotonic()
+        self.compacted_rooms.discard(visible)
+
+        evicted = 0
+        loaded  = 0
+        rooms: List[Tuple[float, "MatrixClient", str]] = []
+
+        for user_id, client in self.backend.clients.items():
+            for room_id in client.past_pages:
+                model = self.backend.models.data.get(
+                    (user_id, room_id, "events"),
+                )
+
+                if not model:
+                    continue
+
+                if (user_id, room_id) == visible:
+                    loaded += len(model)
+                    continue
+
+                if len(model) > self.room_window:
+                    evicted += client.evict_past_events(
+                        room_id, self.room_window,
+                    )
+
+                self.compact(user_id, room_id)
+
+                loaded += len(model)
+                viewed  = self.last_viewed.get((user_id, room_id), 0)
+                rooms.append((viewed, client, room_id))
+
+        budget = self.backend.settings.Chat.max_loaded_events
+        rooms.sort(key=lambda room: room[0])
+
+        for _viewed, client, room_id in rooms:
+            if loaded <= budget:
+                break
+
+            unloaded  = client.evict_past_events(room_id, keep=0)
+            loaded   -= unloaded
+            evicted  += unloaded
+
+        if evicted:
+            log.debug("Unloaded %d events, %d still loaded", evicted, loaded)
+
+        return evicted
+
+
+    def compact(self, user_id: str, room_id: str) -> int:
+        """Compact the loaded events of a room, return how many were.
+
+        Once a room has been entirely compacted, only its events newer than
+        the most recent already compacted one are checked.
+        """
+
+        model = self.backend.models.data.get((user_id, room_id, "events"))
+
+        if not model:
+            return 0
+
+        done    = 0
+        partial = (user_id, room_id) in self.compacted_rooms
+
+        for event in model._sorted_data:
+            if event.compact():
+                done += 1
+            elif partial and event.compacted:
+                break
+
+        self.compacted_rooms.add((user_id, room_id))
+        return done
+
+
+    async def _run(self) -> None:
+        """Call `evict()` every `check_interval` seconds."""
+
+        while True:
+            await asyncio.sleep(self.check_interval)
+
+            try:
+                self.evict()
+            except Exception as err:  # noqa
+                LoopException(str(err), err, traceback.format_exc().rstrip())
@@ -19,7 +19,7 @@ from enum import Enum
 from enum import auto as autostr
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from types import ModuleType
+from types import MappingProxyType, ModuleType
 from typing import (
     Any, AsyncIterator, Callable, Collection, Dict, Iterable, Mapping,
     Optional, Tuple, Type, Union,
@@ -49,6 +49,9 @@ auto       = autostr
 
 COMPRESSION_POOL = ProcessPoolExecutor()
 
+# {(value type, json_list_dicts, reject_unknown): conversion function}
+QML_SERIALIZERS: Dict[Tuple[type, bool, bool], Callable[[Any], Any]] = {}
+
 
 class AutoStrEnum(Enum):
     """An Enum where auto() assigns the member's name instead of an integer.
@@ -207,6 +210,9 @@ def serialize_value_for_qml(
 ) -> Any:
     """Convert a value to make it easier to use from QML.
 
+    The conversion to do is determined once for each type and set of
+    arguments, then cached in `QML_SERIALIZERS`.
+
     Returns:
 
     - For `bool`, `int`, `float`, `bytes`, `str`, `datetime`, `date`, `time`:
@@ -234,42 +240,65 @@ def serialize_value_for_qml(
       else return the unchanged value.
     """
 
-    if isinstance(value, (bool, int, float, bytes, str, datetime, date, time)):
-        return value
+    key        = (type(value), json_list_dicts, reject_unknown)
+    serializer = QML_SERIALIZERS.get(key)
+
+    if serializer is None:
+        serializer = QML_SERIALIZERS[key] = _find_qml_serializer(*key)
+
+    return serializer(value)
+
 
-    if json_list_dicts and isinstance(value, Collection):
-        if isinstance(value, set):
-            value = list(value)
-        return json.dumps(value)
+def _find_qml_serializer(
+    value_type: type, json_list_dicts: bool, reject_unknown: bool,
+) -> Callable[[Any], Any]:
+    """Return the conversion `serialize_value_for_qml` does for a type."""
 
-    if not inspect.isclass(value) and hasattr(value, "serialized"):
-        return value.serialized
+    primitives = (bool, int, float, bytes, str, datetime, date, time)
 
-    if isinstance(value, Iterable):
-        return value
+    if issubclass(value_type, primitives):
+        return lambda value: value
 
-    if hasattr(value, "__class__") and issubclass(value.__class__, Enum):
-        return value.value
+    if json_list_dicts and issubclass(value_type, Collection):
+        if issubclass(value_type, set):
+            return lambda value: json.dumps(list(value))
+        if issubclass(value_type, MappingProxyType):
+            return lambda value: json.dumps(dict(value))
+        return json.dumps
 
-    if isinstance(value, Path):
-        return f"file://{value!s}"
+    is_class = issubclass(value_type, type)
 
-    if isinstance(value, UUID):
-        return str(value)
+    if not is_class and hasattr(value_type, "serialized"):
+        return lambda value: value.serialized
 
-    if isinstance(value, timedelta):
-        return value.total_seconds() * 1000
+    if issubclass(value_type, Iterable):
+        return lambda value: value
 
-    if isinstance(value, Color):
-        return value.hex
+    if issubclass(value_type, Enum):
+        return lambda value: value.value
 
-    if inspect.isclass(value):
-        return value.__name__
+    if issubclass(value_type, Path):
+        return lambda value: f"file://{value!s}"
+
+    if issubclass(value_type, UUID):
+        return str
+
+    if issubclass(value_type, timedelta):
+        return lambda value: value.total_seconds() * 1000
+
+    if issubclass(value_type, Color):
+        return lambda value: value.hex
+
+    if is_class:
+        return lambda value: value.__name__
 
     if reject_unknown:
-        raise TypeError("Unknown type reject")
+        def reject(value: Any) -> Any:
+            raise TypeError("Unknown type reject")
+
+        return reject
 
-    return value
+    return lambda value: value
 
 
 def deep_serialize_for_qml(obj: Iterable) -> Union[list, dict]:
@@ -158,6 +158,12 @@ class Chat:
     # Show a notice in the timeline for types of events that aren't recognized.
     show_unknown_events: bool = False
 
+    # Maximum number of messages and other events to keep loaded in memory
+    # for all rooms. When there are more, the events of the rooms that weren't
+    # viewed for the longest time are unloaded, and will be loaded again
+    # from the server when needed.
+    max_loaded_events: int = 20_000
+
     # In a chat with unread messages, the messages will be marked as read
     # after this number of seconds.
     # Focusing another window or chat resets the timer.
@@ -215,6 +221,14 @@ class Chat:
         # reveals the hidden controls.
         autohide_image_controls_after: float = 2.0
 
+        # Maximum disk space in megabytes that downloaded files and thumbnails
+        # can each take in the cache folder. When more space is used, the
+        # files that weren't accessed for the longest time are deleted, and
+        # will be downloaded again if needed. Files for messages currently
+        # loaded in a room are never deleted. Set to 0 to have no limit.
+        max_downloads_cache_size: int = 2048
+        max_thumbnails_cache_size: int = 512
+
 class Keys:
     # All keybind settings, unless their comment says otherwise, are list of
     # the possible shortcuts for an action, e.g. ["Ctrl+A", "Alt+Shift+A"].
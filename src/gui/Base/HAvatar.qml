@@ -66,6 +66,7 @@ Rectangle {
         sourceSize.width: parent.width
         sourceSize.height: parent.height
         showProgressBar: false
+        downloadPriority: "Avatar"
         fillMode: Image.PreserveAspectCrop
         animatedFillMode: AnimatedImage.PreserveAspectCrop
         animate: false
@@ -97,6 +98,7 @@ Rectangle {
 
                 sourceComponent: HMxcImage {
                     id: avatarToolTipImage
+                    downloadPriority: "Avatar"
                     fillMode: Image.PreserveAspectCrop
                     animatedFillMode: AnimatedImage.PreserveAspectCrop
                     clientUserId: avatarImage.clientUserId
@@ -16,11 +16,16 @@ HImage {
     property bool thumbnail: true
     property var cryptDict: ({})
 
+    // Name of a backend DownloadPriority, see media_cache.py
+    property string downloadPriority:
+        thumbnail ? "VisibleThumbnail" : "UserDownload"
+
     property string cachedPath: ""
     property bool canUpdate: true
     property bool show: ! canUpdate
 
     property string getFutureId: ""
+    property string forgottenPath: ""
 
     readonly property bool isMxc: mxc.startsWith("mxc://")
 
@@ -44,6 +49,7 @@ HImage {
         const method = image.thumbnail ? "get_thumbnail" : "get_media"
         let   args   = [
             clientUserId, image.mxc, image.title, roomId, fileSize, cryptDict,
+            downloadPriority,
         ]
         if (image.thumbnail) args = [w, h, ...args]
 
@@ -70,5 +76,15 @@ HImage {
     onHeightChanged: Qt.callLater(reload)
     onVisibleChanged: Qt.callLater(reload)
     onMxcChanged: Qt.callLater(reload)
+    onStatusChanged: {
+        // The cached file may have been deleted by something else than us,
+        // have it downloaded again (once, in case it is actually broken)
+        if (status !== Image.Error || ! cachedPath || sourceOverride) return
+        if (cachedPath === forgottenPath) return
+
+        forgottenPath = cachedPath
+        cachedPath    = ""
+        py.callCoro("media_cache.forget", [forgottenPath], reload)
+    }
     Component.onDestruction: if (getFutureId) py.cancelCoro(getFutureId)
 }
@@ -364,10 +364,13 @@ Rectangle {
         }
 
         function loadPastEvents() {
+            // Request at least about as many events as can fit on screen
+            const wanted = Math.ceil(height / theme.baseElementsHeight)
+
             loadPastEventsFutureId = py.callClientCoro(
                 chat.userId,
                 "load_past_events",
-                [chat.roomId],
+                [chat.roomId, wanted],
                 more => {
                     moreToLoad             = more
                     loadPastEventsFutureId = ""
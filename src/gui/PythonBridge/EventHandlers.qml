@@ -126,6 +126,17 @@ QtObject {
         model.idToItems = {}
     }
 
+    function onModelBatchChanged(syncId, changes) {
+        for (let i = 0; i < changes.length; i++) {
+            const [type, ...args] = changes[i]
+
+            type === "set" ? onModelItemSet(syncId, ...args) :
+            type === "delete" ? onModelItemDeleted(syncId, ...args) :
+            type === "clear" ? onModelCleared(syncId) :
+            null
+        }
+    }
+
     function onDevicesUpdated(forAccount) {
         deviceUpdateSignal(forAccount)
     }